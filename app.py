@@ -1,11 +1,80 @@
 import flask
 from flask import Flask, render_template, request, flash, redirect, url_for, session, jsonify, make_response, Response
-import base64, time, json, re, os, uuid, threading, requests, smtplib, sys, random
+import base64, time, json, re, os, uuid, threading, requests, smtplib, sys, random, sqlite3, copy, hashlib, gzip, bisect, math, queue, atexit, shutil, ipaddress, csv, io, unicodedata, hmac
 import http.client
 from datetime import datetime, timedelta
+from collections import deque, OrderedDict
 from openai import OpenAI
+from flask.json.provider import DefaultJSONProvider
+
+# 可选的高性能JSON库：优先orjson，其次msgspec，都未安装时使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+# 可选的brotli压缩，未安装时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# 可选的openpyxl，未安装时学生名单只能以CSV导入
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# 数据文件默认以紧凑格式写入；设置JSON_PRETTY=1时使用缩进格式，便于人工查看
+JSON_PRETTY = os.getenv('JSON_PRETTY', '').lower() in ('1', 'true', 'yes')
+
+def json_dumps_bytes(obj, pretty=False, sort_keys=False, default=None):
+    """序列化为UTF-8编码的JSON字节（不转义中文）"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    if msgspec is not None and not sort_keys:
+        data = msgspec.json.encode(obj, enc_hook=default)
+        return msgspec.json.format(data, indent=2) if pretty else data
+    return json_dumps(obj, pretty, sort_keys, default).encode('utf-8')
+
+def json_dumps(obj, pretty=False, sort_keys=False, default=None):
+    """序列化为JSON字符串（不转义中文）"""
+    if orjson is not None or (msgspec is not None and not sort_keys):
+        return json_dumps_bytes(obj, pretty, sort_keys, default).decode('utf-8')
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=default)
+
+def json_loads(data):
+    """解析JSON字符串或字节，格式错误时统一抛出json.JSONDecodeError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise json.JSONDecodeError(str(e), '', 0)
+    return json.loads(data)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """让jsonify与数据文件使用同一套JSON编码器"""
+
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), default=self.default)
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
 
 app = Flask(__name__) # 创建 Flask 应用
+app.json_provider_class = FastJSONProvider
+app.json = FastJSONProvider(app)
 app.secret_key = 'test_key'  # 生产环境中使用强密钥
 
 @app.context_processor
@@ -25,7 +94,86 @@ IP_FILE = os.path.join(DATA_DIR, 'ips.json')
 STUDENTS_FILE = os.path.join(DATA_DIR, 'students.json')
 LOGIN_LOG_FILE = os.path.join(DATA_DIR, 'login.log')
 INPUT_LOG_FILE = os.path.join(DATA_DIR, 'input.log')
+INPUT_INDEX_FILE = os.path.join(DATA_DIR, 'input.log.idx')
 PASSWORD_FILE = os.path.join(DATA_DIR, 'password.json')
+PROMPT_LOG_FILE = os.path.join(DATA_DIR, 'prompt.log')
+GLOBAL_WORDS_FILE = os.path.join(DATA_DIR, 'global_words.json')
+HOMEWORK_DB_FILE = os.path.join(DATA_DIR, 'homework.db')
+HOMEWORK_ID_FILE = os.path.join(DATA_DIR, 'homework_ids.json')
+AI_LIMIT_DB_FILE = os.path.join(DATA_DIR, 'ai_limits.db')
+CREDENTIALS_DB_FILE = os.path.join(DATA_DIR, 'credentials.db')
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+
+# 可信反向代理（逗号分隔的IP或CIDR）：只有直连地址属于这些代理时才采用X-Forwarded-For等头部中的客户端IP，
+# 否则任何人都能伪造头部冒充管理员IP
+TRUSTED_PROXIES = os.getenv('TRUSTED_PROXIES', '127.0.0.1,::1')
+
+# 作业存储后端：json（默认，data/submissions.json）或 sqlite（data/homework.db）
+HOMEWORK_BACKEND = os.getenv('HOMEWORK_BACKEND', 'json').lower()
+# 墓碑记录累积到该数量时压缩存储
+HOMEWORK_COMPACT_THRESHOLD = int(os.getenv('HOMEWORK_COMPACT_THRESHOLD', '20'))
+# 批量布置作业单次最多条数
+HOMEWORK_BULK_LIMIT = int(os.getenv('HOMEWORK_BULK_LIMIT', '50'))
+# 到期查询within参数的最大范围（天），超出按该值处理
+HOMEWORK_DUE_MAX_DAYS = int(os.getenv('HOMEWORK_DUE_MAX_DAYS', '366'))
+# 看板增量同步保留的最大变更条数
+CHANGE_LOG_SIZE = int(os.getenv('CHANGE_LOG_SIZE', '500'))
+# 看板推送（SSE）：最大同时订阅数与心跳间隔（秒）
+SSE_MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_SUBSCRIBERS', '50'))
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+# 响应压缩：各内容类型的最小压缩字节数（未列出的类型不压缩）
+COMPRESS_MIN_SIZE = {
+    'application/json': 512,
+    'text/html': 1024,
+    'text/plain': 1024,
+}
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+COMPRESS_CACHE_SIZE = int(os.getenv('COMPRESS_CACHE_SIZE', '64'))
+# 作业归档：截止日期已过去多少天后移入按月分区的归档文件；检查间隔（秒，0表示只在启动时执行一次）
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '7'))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', '3600'))
+# 归档线程只在python app.py启动的服务进程中运行；由gunicorn等加载时默认不启动，
+# 设置ARCHIVE_WORKER=1在（且只在）其中一个进程中开启，避免多个进程同时改写作业数据
+ARCHIVE_WORKER = os.getenv('ARCHIVE_WORKER', '').lower() in ('1', 'true', 'yes')
+# 日志异步写入：LOG_ASYNC=0时在请求线程同步写入
+LOG_ASYNC = os.getenv('LOG_ASYNC', '1').lower() not in ('0', 'false', 'no')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_SECONDS = float(os.getenv('LOG_FLUSH_SECONDS', '0.5'))
+# fsync策略：-1不主动fsync（交给操作系统），0每批写入后fsync，N表示最多每N秒fsync一次
+LOG_FSYNC_SECONDS = float(os.getenv('LOG_FSYNC_SECONDS', '-1'))
+# 日志轮转：单个文件超过LOG_ROTATE_MB（0为不限）或跨天（LOG_ROTATE_DAILY）时切分，
+# 切出的分段gzip压缩，每种日志最多保留LOG_RETENTION个分段
+LOG_ROTATE_MB = float(os.getenv('LOG_ROTATE_MB', '10'))
+LOG_ROTATE_DAILY = os.getenv('LOG_ROTATE_DAILY', '1').lower() not in ('0', 'false', 'no')
+LOG_RETENTION = int(os.getenv('LOG_RETENTION', '30'))
+# 各端点的滑动窗口限流策略：每条规则为时间窗口（秒）内最多请求次数；可用RATE_LIMIT_POLICIES（JSON）覆盖
+RATE_LIMIT_POLICIES = {
+    'fun_submit': [
+        {"window": 30, "limit": 1, "message": "提交过于频繁，请间隔至少30秒再提交！"},
+        {"window": 24 * 60 * 60, "limit": 15, "message": "您今天的提交次数已达上限（15次）！"}
+    ]
+}
+RATE_LIMIT_POLICIES.update(json.loads(os.getenv('RATE_LIMIT_POLICIES', '{}')))
+# AI聊天令牌桶配额：capacity为桶容量，period秒内补满；每日token预算按每个用户计算（按字符数近似）
+AI_QUOTAS = {
+    'private': {"capacity": 3, "period": 60, "message": "私人对话中，每分钟最多只能发送3条消息！"},
+    'public': {"capacity": 1, "period": 120, "message": "公共聊天中，非AI消息每2分钟只能发送一条！"}
+}
+AI_DAILY_TOKEN_BUDGET = int(os.getenv('AI_DAILY_TOKEN_BUDGET', '50000'))
+# 配额计数存储：memory（单进程）或 sqlite（data/ai_limits.db，多个worker共享）
+AI_LIMIT_BACKEND = os.getenv('AI_LIMIT_BACKEND', 'memory').lower()
+# 留言板输入（input.log，JSONL）：墓碑达到该数量时后台压缩；每追加多少条保存一次偏移索引
+INPUT_COMPACT_THRESHOLD = int(os.getenv('INPUT_COMPACT_THRESHOLD', '50'))
+INPUT_INDEX_SAVE_EVERY = int(os.getenv('INPUT_INDEX_SAVE_EVERY', '100'))
+# 密码存储：PBKDF2-SHA256迭代次数；验证成功结果的缓存时间（秒，0为不缓存）与最大条数
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '120000'))
+PASSWORD_CACHE_TTL = float(os.getenv('PASSWORD_CACHE_TTL', '300'))
+PASSWORD_CACHE_SIZE = int(os.getenv('PASSWORD_CACHE_SIZE', '1024'))
+# 旧版明文password.json迁移完成后默认删除；设置PASSWORD_KEEP_LEGACY_BACKUP=1时改名为password.json.migrated保留
+# （备份中仍是明文密码，确认迁移无误后应手动删除）
+PASSWORD_KEEP_LEGACY_BACKUP = os.getenv('PASSWORD_KEEP_LEGACY_BACKUP', '').lower() in ('1', 'true', 'yes')
 
 default_labels = [
   {
@@ -80,25 +228,1399 @@ default_labels = [
   }
 ]
 
+class JsonFileStore:
+    """进程级JSON文件缓存：仅在文件签名（mtime/大小/inode）变化或本地写入后重新解析"""
+
+    def __init__(self, path, default=list):
+        self.path = path
+        self.default = default  # 文件不存在或损坏时使用的默认值工厂
+        self._lock = threading.RLock()
+        self._data = None
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.last_write = None  # 最近一次本地写入的(写入前版本, 写入后版本)，供变更日志区分外部修改
+
+    def _file_signature(self):
+        """获取文件签名，文件不存在时返回None"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self):
+        """返回缓存的数据（调用方不得原地修改）"""
+        with self._lock:
+            signature = self._file_signature()
+            if self._data is not None and signature == self._signature:
+                self.hits += 1
+                return self._data
+            self.misses += 1
+            if signature is None:
+                data = self.default()
+            else:
+                try:
+                    with open(self.path, 'rb') as f:
+                        st = os.fstat(f.fileno())
+                        data = json_loads(f.read())
+                    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    # 文件损坏或正被外部写入：不缓存兜底值，下次读取重试；已有缓存时继续使用旧数据
+                    if self._data is not None:
+                        return self._data
+                    return self.default()
+            self._data = data
+            self._signature = signature
+            return data
+
+    def save(self, data):
+        """写入临时文件后原子替换，并直接刷新缓存，避免下一次读取重新解析"""
+        with self._lock:
+            before = self.version()
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'  # 多个进程同时写入时各用各的临时文件
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps_bytes(data, pretty=JSON_PRETTY))
+            os.replace(tmp_path, self.path)
+            self._data = data
+            self._signature = self._file_signature()
+            self.writes += 1
+            self.last_write = (before, self.version())
+
+    def version(self):
+        """返回文件版本标识（只读取文件元数据，不解析内容）"""
+        signature = self._file_signature()
+        if signature is None:
+            return '0'
+        return '%x-%x-%x' % signature
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+homework_store = JsonFileStore(DATA_FILE)
+labels_store = JsonFileStore(LABELS_FILE, default=lambda: None)
+subjects_store = JsonFileStore(SUBJECTS_FILE, default=lambda: None)
+global_words_store = JsonFileStore(GLOBAL_WORDS_FILE, default=lambda: None)
+ip_store = JsonFileStore(IP_FILE, default=dict)
+students_store = JsonFileStore(STUDENTS_FILE, default=lambda: None)
+
+class LookupTable:
+    """由JsonFileStore数据派生的查找表缓存：数据对象变化（文件版本变化或本地写入）时才重新构建"""
+
+    def __init__(self, store, build):
+        self.store = store
+        self.build = build  # 参数为文件数据（可能为None），返回构建结果
+        self._lock = threading.Lock()
+        self._source = None
+        self._value = None
+        self.builds = 0
+
+    def get(self):
+        """返回构建结果（调用方不得原地修改）"""
+        with self._lock:
+            data = self.store.load()
+            if self._value is None or data is not self._source:
+                self._value = self.build(data)
+                self._source = data
+                self.builds += 1
+            return self._value
+
 def load_submissions():
-    """从JSON文件加载提交数据"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    """从作业缓存加载提交数据（返回副本，调用方可自由修改）"""
+    return [dict(submission) for submission in homework_store.load()]
 
 def save_submissions(submissions):
     """将提交数据保存到JSON文件"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(submissions, f, ensure_ascii=False, indent=2)
+    homework_store.save([dict(submission) for submission in submissions])
+
+def group_by_subject(submissions):
+    """按学科分组作业（保持学科首次出现的顺序）"""
+    grouped_submissions = {}
+    for submission in submissions:
+        grouped_submissions.setdefault(submission['subject'], []).append(submission)
+    return grouped_submissions
+
+class HomeworkIdAllocator:
+    """单调递增的作业ID分配器，持久化到文件，删除后的ID不会被复用"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                try:
+                    return int(json_loads(f.read()).get('next_id', 1))
+                except (json.JSONDecodeError, ValueError, AttributeError):
+                    pass
+        return 1
+
+    def allocate(self, existing_max=0, count=1):
+        """分配count个连续的新ID并返回第一个；existing_max用于防止数据文件被手工恢复后ID回退"""
+        with self._lock:
+            next_id = max(self._read(), existing_max + 1)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json_dumps({'next_id': next_id + count}))
+            return next_id
+
+class JsonHomeworkRepository:
+    """基于submissions.json的作业存储（删除写入墓碑标记，累积到阈值后压缩）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()  # 串行化“读取-修改-写回”
+        self._ids = HomeworkIdAllocator(HOMEWORK_ID_FILE)
+        self._indexed = None  # 建立索引时对应的缓存列表
+        self._positions = {}  # 有效作业ID -> 列表下标
+        self._max_id = 0
+        self._tombstones = 0
+
+    def _index(self):
+        """返回缓存列表及ID索引，缓存数据变化时重建"""
+        with self._lock:
+            records = homework_store.load()
+            if records is not self._indexed:
+                self._positions = {}
+                self._max_id = 0
+                self._tombstones = 0
+                for i, record in enumerate(records):
+                    self._max_id = max(self._max_id, record['id'])
+                    if record.get('deleted'):
+                        self._tombstones += 1
+                    else:
+                        self._positions[record['id']] = i
+                self._indexed = records
+            return records, self._positions
+
+    def version(self):
+        """返回作业数据版本（文件签名）"""
+        return homework_store.version()
+
+    @property
+    def last_write(self):
+        return homework_store.last_write
+
+    def all(self):
+        return [dict(record) for record in homework_store.load() if not record.get('deleted')]
+
+    def get(self, homework_id):
+        records, positions = self._index()
+        position = positions.get(homework_id)
+        return dict(records[position]) if position is not None else None
+
+    def grouped_by_subject(self):
+        return group_by_subject(self.all())
+
+    def insert(self, record):
+        """添加作业并分配新ID，返回保存后的记录"""
+        with self._lock:
+            self._index()
+            record = dict(record, id=self._ids.allocate(self._max_id))
+            submissions = load_submissions()
+            submissions.append(record)
+            save_submissions(submissions)
+            return record
+
+    def insert_many(self, records):
+        """批量添加作业（一次写入），返回保存后的记录列表"""
+        with self._lock:
+            self._index()
+            first_id = self._ids.allocate(self._max_id, len(records))
+            records = [dict(record, id=first_id + offset) for offset, record in enumerate(records)]
+            submissions = load_submissions()
+            submissions.extend(records)
+            save_submissions(submissions)
+            return records
+
+    def update(self, record):
+        """按ID整体替换一条作业"""
+        return bool(self.update_many([record]))
+
+    def update_many(self, records):
+        """按ID批量替换作业（一次写入），返回实际更新的作业ID列表"""
+        with self._lock:
+            _, positions = self._index()
+            records = [record for record in records if record['id'] in positions]
+            if not records:
+                return []
+            submissions = load_submissions()
+            for record in records:
+                submissions[positions[record['id']]] = dict(record)
+            save_submissions(submissions)
+            return [record['id'] for record in records]
+
+    def delete(self, homework_id):
+        """将作业标记为墓碑，墓碑数量达到阈值时顺带压缩"""
+        return bool(self.delete_many([homework_id]))
+
+    def delete_many(self, homework_ids):
+        """批量标记墓碑（一次写入），返回实际删除的作业ID列表"""
+        with self._lock:
+            _, positions = self._index()
+            deleted_ids = []
+            for homework_id in homework_ids:
+                if homework_id in positions and homework_id not in deleted_ids:
+                    deleted_ids.append(homework_id)
+            if not deleted_ids:
+                return []
+            submissions = load_submissions()
+            deleted_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for homework_id in deleted_ids:
+                submissions[positions[homework_id]] = {
+                    'id': homework_id,
+                    'deleted': True,
+                    'deleted_at': deleted_at
+                }
+            if self._tombstones + len(deleted_ids) >= HOMEWORK_COMPACT_THRESHOLD:
+                submissions = [s for s in submissions if not s.get('deleted')]
+            save_submissions(submissions)
+            return deleted_ids
+
+    def compact(self):
+        """清除所有墓碑记录，返回清除条数"""
+        with self._lock:
+            self._index()
+            if not self._tombstones:
+                return 0
+            removed = self._tombstones
+            save_submissions([s for s in load_submissions() if not s.get('deleted')])
+            return removed
+
+class SqliteHomeworkRepository:
+    """基于SQLite的作业存储，单条增删改与学科分组均在数据库中完成"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()  # 每个线程独立连接
+        self.last_write = None
+        conn = self._connect()
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS homework (
+                    id INTEGER PRIMARY KEY,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    labels TEXT NOT NULL DEFAULT '[]',
+                    label_ids TEXT,
+                    deadline TEXT NOT NULL DEFAULT '',
+                    timestamp TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS homework_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(homework)')]
+            if 'deleted' not in columns:
+                conn.execute('ALTER TABLE homework ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0')
+            conn.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_homework_subject ON homework(subject);
+                CREATE INDEX IF NOT EXISTS idx_homework_deadline ON homework(deadline);
+                CREATE INDEX IF NOT EXISTS idx_homework_timestamp ON homework(timestamp);
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO homework_meta (key, value) "
+                "SELECT 'next_id', COALESCE(MAX(id), 0) + 1 FROM homework")
+            conn.execute("INSERT OR IGNORE INTO homework_meta (key, value) VALUES ('version', 0)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_row(record):
+        label_ids = record.get('label_ids')
+        return (
+            record.get('subject', ''),
+            record.get('content', ''),
+            json_dumps(record.get('labels', [])),
+            json_dumps(label_ids) if label_ids is not None else None,
+            record.get('deadline', '') or '',
+            record.get('timestamp', '')
+        )
+
+    @staticmethod
+    def _from_row(row):
+        record = {
+            'id': row[0],
+            'subject': row[1],
+            'content': row[2],
+            'labels': json_loads(row[3]),
+            'deadline': row[5],
+            'timestamp': row[6]
+        }
+        if row[4] is not None:
+            record['label_ids'] = json_loads(row[4])
+        return record
+
+    def _bump_version(self, conn):
+        """在当前事务内递增数据版本，并记录本地写入的(写入前版本, 写入后版本)"""
+        (version,) = conn.execute("SELECT value FROM homework_meta WHERE key = 'version'").fetchone()
+        conn.execute("UPDATE homework_meta SET value = value + 1 WHERE key = 'version'")
+        self.last_write = (str(version), str(version + 1))
+
+    def version(self):
+        """返回作业数据版本（写入计数）"""
+        (version,) = self._connect().execute("SELECT value FROM homework_meta WHERE key = 'version'").fetchone()
+        return str(version)
+
+    def all(self):
+        rows = self._connect().execute(
+            'SELECT id, subject, content, labels, label_ids, deadline, timestamp FROM homework '
+            'WHERE deleted = 0 ORDER BY id')
+        return [self._from_row(row) for row in rows]
+
+    def get(self, homework_id):
+        row = self._connect().execute(
+            'SELECT id, subject, content, labels, label_ids, deadline, timestamp FROM homework '
+            'WHERE id = ? AND deleted = 0', (homework_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def grouped_by_subject(self):
+        # 学科按首次出现的作业ID排序，与JSON存储的分组顺序一致
+        rows = self._connect().execute("""
+            SELECT h.id, h.subject, h.content, h.labels, h.label_ids, h.deadline, h.timestamp
+            FROM homework h
+            JOIN (SELECT subject, MIN(id) AS first_id FROM homework WHERE deleted = 0 GROUP BY subject) g
+              ON g.subject = h.subject
+            WHERE h.deleted = 0
+            ORDER BY g.first_id, h.id
+        """)
+        return group_by_subject(self._from_row(row) for row in rows)
+
+    def _allocate_id(self, conn, count=1):
+        """在当前事务内分配count个连续的新ID并返回第一个"""
+        conn.execute("UPDATE homework_meta SET value = value + ? WHERE key = 'next_id'", (count,))
+        (next_id,) = conn.execute("SELECT value FROM homework_meta WHERE key = 'next_id'").fetchone()
+        return next_id - count
+
+    def insert(self, record):
+        conn = self._connect()
+        with conn:
+            record = dict(record, id=self._allocate_id(conn))
+            conn.execute(
+                'INSERT INTO homework (id, subject, content, labels, label_ids, deadline, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', (record['id'],) + self._to_row(record))
+            self._bump_version(conn)
+        return record
+
+    def insert_many(self, records):
+        """批量添加作业（单个事务），返回保存后的记录列表"""
+        conn = self._connect()
+        with conn:
+            first_id = self._allocate_id(conn, len(records))
+            records = [dict(record, id=first_id + offset) for offset, record in enumerate(records)]
+            conn.executemany(
+                'INSERT INTO homework (id, subject, content, labels, label_ids, deadline, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', [(record['id'],) + self._to_row(record) for record in records])
+            self._bump_version(conn)
+        return records
+
+    def update(self, record):
+        return bool(self.update_many([record]))
+
+    def update_many(self, records):
+        """按ID批量替换作业（单个事务），返回实际更新的作业ID列表"""
+        conn = self._connect()
+        updated_ids = []
+        with conn:
+            for record in records:
+                cursor = conn.execute(
+                    'UPDATE homework SET subject = ?, content = ?, labels = ?, label_ids = ?, deadline = ?, timestamp = ? '
+                    'WHERE id = ? AND deleted = 0', self._to_row(record) + (record['id'],))
+                if cursor.rowcount:
+                    updated_ids.append(record['id'])
+            if updated_ids:
+                self._bump_version(conn)
+        return updated_ids
+
+    def delete(self, homework_id):
+        """将作业标记为墓碑，墓碑数量达到阈值时压缩"""
+        return bool(self.delete_many([homework_id]))
+
+    def delete_many(self, homework_ids):
+        """批量标记墓碑（单个事务），返回实际删除的作业ID列表"""
+        conn = self._connect()
+        deleted_ids = []
+        with conn:
+            for homework_id in homework_ids:
+                cursor = conn.execute('UPDATE homework SET deleted = 1 WHERE id = ? AND deleted = 0', (homework_id,))
+                if cursor.rowcount:
+                    deleted_ids.append(homework_id)
+            if not deleted_ids:
+                return []
+            self._bump_version(conn)
+            (tombstones,) = conn.execute('SELECT COUNT(*) FROM homework WHERE deleted = 1').fetchone()
+        if tombstones >= HOMEWORK_COMPACT_THRESHOLD:
+            self.compact()
+        return deleted_ids
+
+    def compact(self):
+        """清除所有墓碑记录，返回清除条数"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM homework WHERE deleted = 1')
+        return cursor.rowcount
+
+    def import_from_json(self, json_file=DATA_FILE):
+        """一次性从submissions.json导入（通过user_version标记只执行一次），返回导入条数"""
+        conn = self._connect()
+        (imported,) = conn.execute('PRAGMA user_version').fetchone()
+        if imported:
+            return 0
+        records = []
+        if os.path.exists(json_file):
+            with open(json_file, 'r', encoding='utf-8') as f:
+                try:
+                    records = json_loads(f.read())
+                except json.JSONDecodeError:
+                    records = []
+        records = [record for record in records if not record.get('deleted')]
+        with conn:
+            conn.executemany(
+                'INSERT INTO homework (id, subject, content, labels, label_ids, deadline, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(record['id'],) + self._to_row(record) for record in records])
+            conn.execute(
+                "UPDATE homework_meta SET value = MAX(value, (SELECT COALESCE(MAX(id), 0) + 1 FROM homework)) "
+                "WHERE key = 'next_id'")
+            self._bump_version(conn)
+            conn.execute('PRAGMA user_version = 1')
+        return len(records)
+
+def create_homework_repository():
+    """根据HOMEWORK_BACKEND配置创建作业存储"""
+    if HOMEWORK_BACKEND == 'sqlite':
+        repo = SqliteHomeworkRepository(HOMEWORK_DB_FILE)
+        repo.import_from_json()
+        return repo
+    return JsonHomeworkRepository()
+
+homework_repo = create_homework_repository()
+
+def board_data_version():
+    """看板相关数据（作业、标签、科目）的当前版本"""
+    return (homework_repo.version(), labels_store.version(), subjects_store.version())
+
+class ChangeLog:
+    """有界的版本化变更日志，供看板按版本增量同步
+
+    版本号格式为“进程纪元:序号”，纪元不同（进程重启或多进程）时客户端回退到全量快照；
+    检测到不经本进程写入的数据变化时同样清空日志，强制全量同步。
+    """
+
+    def __init__(self, maxlen=CHANGE_LOG_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._entries = deque(maxlen=maxlen)
+        self._version = 0
+        self._floor = 0  # 可增量同步的最小起始版本
+        self._data_version = None
+        self._cond = threading.Condition()  # 写入时唤醒推送连接
+
+    def _token(self):
+        return f"{self.epoch}:{self._version}"
+
+    def _sync(self):
+        """数据被外部修改时清空日志"""
+        current = board_data_version()
+        if current != self._data_version:
+            self._version += 1
+            self._entries.clear()
+            self._floor = self._version
+            self._data_version = current
+
+    def _sync_before_record(self):
+        """记录本地写入前检查外部修改：各数据源的变化若都能由其最近一次本地写入解释则视为本进程写入，
+        否则先按外部修改清空日志，避免外部变更被并入本地版本号而漏发给增量客户端"""
+        if self._data_version is None:
+            return self._sync()
+        current = board_data_version()
+        expected = list(self._data_version)
+        for i, source in enumerate((homework_repo, labels_store, subjects_store)):
+            if expected[i] != current[i] and getattr(source, 'last_write', None) == (expected[i], current[i]):
+                expected[i] = current[i]
+        if tuple(expected) != current:
+            self._sync()
+
+    def record(self, kind, action=None, homework_ids=()):
+        """记录一次已提交的写入：kind为homework/labels/subjects"""
+        with self._cond:
+            self._sync_before_record()
+            if len(self._entries) == self._entries.maxlen:
+                self._floor = self._entries[0]['version']
+            self._version += 1
+            self._entries.append({
+                'version': self._version,
+                'kind': kind,
+                'action': action,
+                'homework_ids': list(homework_ids)
+            })
+            self._data_version = board_data_version()
+            self._cond.notify_all()
+            return self._token()
+
+    def wait_for_change(self, token, timeout):
+        """阻塞直到版本不同于token或超时，返回是否有变化"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._token() != token, timeout)
+
+    def changes_since(self, token):
+        """返回(当前版本, 变更条目)；无法增量同步时条目为None"""
+        with self._cond:
+            self._sync()
+            epoch, _, number = (token or '').partition(':')
+            if epoch != self.epoch or not number.isdigit():
+                return self._token(), None
+            since = int(number)
+            if since < self._floor or since > self._version:
+                return self._token(), None
+            return self._token(), [entry for entry in self._entries if entry['version'] > since]
+
+change_log = ChangeLog()
+
+class SubscriberLimiter:
+    """限制同时在线的推送连接数"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+stream_subscribers = SubscriberLimiter(SSE_MAX_SUBSCRIBERS)
+
+class BoardView:
+    """看板预计算视图：学科顺序、分组作业与标签
+
+    仅当作业、标签、科目任一数据版本变化时重建，其余请求直接复用序列化后的字节。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._etag = None
+        self._body = None
+        self.builds = 0
+
+    def get(self):
+        """返回(etag, 序列化后的JSON字节)"""
+        with self._lock:
+            # 先取变更日志版本再读数据，保证客户端据此增量同步时不会漏掉变更
+            version, _ = change_log.changes_since(None)
+            key = board_data_version()
+            if key != self._key:
+                payload = {
+                    "version": version,
+                    "full": True,
+                    "subjects": Subject.get_subject_order(),
+                    "submissions": homework_repo.grouped_by_subject(),
+                    "labels": Label.load_labels()
+                }
+                self._body = json_dumps_bytes(payload)
+                # 构建过程可能写入默认标签/科目文件，按构建后的版本记录，避免首个ETag立即失效
+                key = board_data_version()
+                self._etag = make_etag('board', *key)
+                self._key = key
+                self.builds += 1
+            return self._etag, self._body
+
+board_view = BoardView()
+
+class DeadlineIndex:
+    """按截止日期排序的作业索引：有截止日期的作业按(deadline, id)有序存放，无截止日期的单独成桶
+
+    写入后通过notify_homework_change增量更新；作业数据在进程外被修改（版本不一致）时整体重建。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = []        # 有序的(deadline, id)
+        self._records = {}     # id -> 作业
+        self._undated = {}     # 无截止日期的作业：id -> 作业（保持发布顺序）
+
+    def _rebuild(self):
+        self._keys = []
+        self._records = {}
+        self._undated = {}
+        for homework in homework_repo.all():
+            self._add(homework, keep_sorted=False)
+        self._keys.sort()
+        self._version = homework_repo.version()
+
+    def _add(self, homework, keep_sorted=True):
+        """加入一条作业（批量重建时先追加、最后统一排序）"""
+        if homework.get('deadline'):
+            self._records[homework['id']] = homework
+            if keep_sorted:
+                bisect.insort(self._keys, (homework['deadline'], homework['id']))
+            else:
+                self._keys.append((homework['deadline'], homework['id']))
+        else:
+            self._undated[homework['id']] = homework
+
+    def _remove(self, homework_id):
+        homework = self._records.pop(homework_id, None)
+        if homework is not None:
+            key = (homework['deadline'], homework_id)
+            position = bisect.bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+        self._undated.pop(homework_id, None)
+
+    def _ensure_fresh(self):
+        if self._version != homework_repo.version():
+            self._rebuild()
+
+    def apply(self, action, homework_ids):
+        """写入提交后增量更新索引"""
+        with self._lock:
+            if self._version is None:
+                return  # 尚未建立索引，首次查询时再全量构建
+            for homework_id in homework_ids:
+                self._remove(homework_id)
+                if action != 'deleted':
+                    homework = homework_repo.get(homework_id)
+                    if homework is not None:
+                        self._add(homework)
+            self._version = homework_repo.version()
+
+    def due_between(self, start, end, subject=None):
+        """返回截止日期在[start, end]（YYYY-MM-DD）之间的作业，按截止日期升序"""
+        with self._lock:
+            self._ensure_fresh()
+            lo = bisect.bisect_left(self._keys, (start,))
+            hi = bisect.bisect_right(self._keys, (end, float('inf')))
+            result = [self._records[homework_id] for _, homework_id in self._keys[lo:hi]]
+        if subject:
+            result = [homework for homework in result if homework['subject'] == subject]
+        return result
+
+    def undated(self, subject=None):
+        """返回无截止日期的作业"""
+        with self._lock:
+            self._ensure_fresh()
+            result = list(self._undated.values())
+        if subject:
+            result = [homework for homework in result if homework['subject'] == subject]
+        return result
+
+deadline_index = DeadlineIndex()
+
+class HomeworkSearchIndex:
+    """作业全文检索倒排索引：按字符二元组切分，无需中文分词
+
+    索引学科、内容与标签三个字段（权重不同），写入后增量更新，版本不一致时整体重建。
+    """
+
+    FIELD_WEIGHTS = (('subject', 2.0), ('content', 1.0), ('labels', 1.5))
+    SEPARATOR_PATTERN = re.compile(r'[\W_]+')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}    # 词元 -> {id: 加权词频}
+        self._doc_tokens = {}  # id -> 该作业的词元集合（删除时使用）
+        self._records = {}     # id -> 作业
+
+    @classmethod
+    def tokenize(cls, text, with_unigrams=False):
+        """去掉空白与标点后切分为字符二元组（“练习册 p.35”与“练习册p35”得到相同词元）
+
+        建索引时同时保留单字，使单字查询也能命中；单字查询本身只产生单字词元。
+        """
+        text = cls.SEPARATOR_PATTERN.sub('', text.lower())
+        if len(text) == 1:
+            return [text]
+        tokens = [text[i:i + 2] for i in range(len(text) - 1)]
+        if with_unigrams:
+            tokens.extend(text)
+        return tokens
+
+    def _add(self, homework):
+        weights = {}
+        for field, weight in self.FIELD_WEIGHTS:
+            value = homework.get(field) or ''
+            if isinstance(value, list):
+                value = ' '.join(value)
+            for token in self.tokenize(value, with_unigrams=True):
+                weights[token] = weights.get(token, 0) + weight
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[homework['id']] = weight
+        self._doc_tokens[homework['id']] = set(weights)
+        self._records[homework['id']] = homework
+
+    def _remove(self, homework_id):
+        for token in self._doc_tokens.pop(homework_id, ()):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.pop(homework_id, None)
+                if not posting:
+                    del self._postings[token]
+        self._records.pop(homework_id, None)
+
+    def _ensure_fresh(self):
+        if self._version != homework_repo.version():
+            self._postings = {}
+            self._doc_tokens = {}
+            self._records = {}
+            for homework in homework_repo.all():
+                self._add(homework)
+            self._version = homework_repo.version()
+
+    def apply(self, action, homework_ids):
+        """写入提交后增量更新索引"""
+        with self._lock:
+            if self._version is None:
+                return  # 尚未建立索引，首次查询时再全量构建
+            for homework_id in homework_ids:
+                self._remove(homework_id)
+                if action != 'deleted':
+                    homework = homework_repo.get(homework_id)
+                    if homework is not None:
+                        self._add(homework)
+            self._version = homework_repo.version()
+
+    def search(self, query, offset=0, limit=20):
+        """返回(命中总数, [(得分, 作业)])：所有词元都须命中，按TF-IDF得分降序、新作业优先"""
+        tokens = set(self.tokenize(query))
+        if not tokens:
+            return 0, []
+        with self._lock:
+            self._ensure_fresh()
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return 0, []
+            postings.sort(key=len)
+            total_docs = len(self._records)
+            scores = {}
+            for homework_id in postings[0]:
+                if all(homework_id in posting for posting in postings[1:]):
+                    scores[homework_id] = sum(
+                        posting[homework_id] * math.log(1 + total_docs / len(posting)) for posting in postings
+                    )
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+            page = [(round(score, 4), self._records[homework_id]) for homework_id, score in ranked[offset:offset + limit]]
+        return len(ranked), page
+
+search_index = HomeworkSearchIndex()
+
+class WordSuggestIndex:
+    """常用词前缀索引：通用词与各科目词表分别排序存放，前缀查询用bisect定位区间
+
+    词频统计自已布置作业的内容：常用词变化或作业在进程外被修改时全量重建，
+    本进程的作业写入通过notify_homework_change只重新统计变更的作业。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._words_key = None
+        self._version = None
+        self._scopes = {}      # None（通用词）或科目名 -> 有序词表
+        self._vocabulary = ()
+        self._counts = {}      # 词 -> 在作业内容中出现的次数
+        self._per_homework = {}  # 作业id -> {词: 次数}，增量更新时用于扣除旧统计
+        self.builds = 0
+
+    def data_version(self):
+        return (global_words_store.version(), subjects_store.version(), homework_repo.version())
+
+    def _words_version(self):
+        return (global_words_store.version(), subjects_store.version())
+
+    def _count(self, homework):
+        content = homework.get('content') or ''
+        return {word: content.count(word) for word in self._vocabulary if word in content}
+
+    def _add(self, homework):
+        found = self._count(homework)
+        if found:
+            self._per_homework[homework['id']] = found
+            for word, count in found.items():
+                self._counts[word] += count
+
+    def _remove(self, homework_id):
+        for word, count in self._per_homework.pop(homework_id, {}).items():
+            self._counts[word] -= count
+
+    def _build(self):
+        global_words = set(Subject.get_all_common_words_list())
+        scopes = {None: sorted(global_words)}
+        for name, subject in Subject.subject_table()["by_name"].items():
+            scopes[name] = sorted(global_words | set(subject.get("common_words", [])))
+        self._scopes = scopes
+        self._vocabulary = tuple(set().union(*scopes.values()))
+        self._counts = dict.fromkeys(self._vocabulary, 0)
+        self._per_homework = {}
+        for homework in homework_repo.all():
+            self._add(homework)
+        self._words_key = self._words_version()
+        self._version = homework_repo.version()
+        self.builds += 1
+
+    def _ensure_fresh(self):
+        if self._words_key != self._words_version() or self._version != homework_repo.version():
+            self._build()
+
+    def apply(self, action, homework_ids):
+        """写入提交后增量更新词频"""
+        with self._lock:
+            if self._version is None:
+                return  # 尚未建立索引，首次查询时再全量构建
+            for homework_id in homework_ids:
+                self._remove(homework_id)
+                if action != 'deleted':
+                    homework = homework_repo.get(homework_id)
+                    if homework is not None:
+                        self._add(homework)
+            self._version = homework_repo.version()
+
+    def suggest(self, subject, prefix, limit):
+        """返回以prefix开头的前limit个(词, 使用次数)，使用次数相同时按词排序"""
+        with self._lock:
+            self._ensure_fresh()
+            words = self._scopes.get(subject, self._scopes[None])
+            lo = bisect.bisect_left(words, prefix)
+            hi = bisect.bisect_left(words, prefix + '\U0010ffff') if prefix else len(words)
+            counts = self._counts
+            ranked = sorted(words[lo:hi], key=lambda word: (-counts[word], word))
+            return [(word, counts[word]) for word in ranked[:limit]]
+
+word_suggest_index = WordSuggestIndex()
+
+def notify_homework_change(action, homework_ids):
+    """作业写入提交后调用：action为added/updated/deleted"""
+    deadline_index.apply(action, homework_ids)
+    search_index.apply(action, homework_ids)
+    word_suggest_index.apply(action, homework_ids)
+    return change_log.record('homework', action, homework_ids)
+
+class HomeworkArchive:
+    """过期作业归档：按截止日期所在月份写入data/archive/YYYY-MM.json，并从在线作业中移除"""
+
+    MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._stores = {}
+        self._thread = None
+
+    def store(self, month):
+        """获取某月归档文件的缓存存储"""
+        with self._lock:
+            if month not in self._stores:
+                self._stores[month] = JsonFileStore(os.path.join(self.archive_dir, month + '.json'))
+            return self._stores[month]
+
+    def months(self):
+        """列出已有归档的月份（升序）"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.archive_dir)
+                      if name.endswith('.json') and self.MONTH_PATTERN.match(name[:-5]))
+
+    def load_month(self, month):
+        """返回某月的归档作业（副本）"""
+        return [dict(homework) for homework in self.store(month).load()]
+
+    @staticmethod
+    def expired_before(homework, cutoff):
+        """截止日期早于cutoff（YYYY-MM-DD）的作业视为过期；无截止日期或格式异常的不归档"""
+        deadline = homework.get('deadline') or ''
+        try:
+            datetime.strptime(deadline[:10], '%Y-%m-%d')
+        except ValueError:
+            return False
+        return deadline[:10] < cutoff
+
+    def archive_expired(self, now=None):
+        """归档过期作业，返回归档的作业ID列表"""
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime('%Y-%m-%d')
+        by_month = {}
+        for homework in homework_repo.all():
+            if self.expired_before(homework, cutoff):
+                by_month.setdefault(homework['deadline'][:7], []).append(homework)
+        if not by_month:
+            return []
+        
+        # 先写归档再删除，中途失败时最多产生重复归档，不会丢失作业
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived_at = now.strftime("%Y-%m-%d %H:%M:%S")
+        for month, items in by_month.items():
+            store = self.store(month)
+            archived = self.load_month(month)
+            known_ids = {homework.get('id') for homework in archived}
+            for homework in items:
+                if homework['id'] not in known_ids:
+                    archived.append(dict(homework, archived_at=archived_at))
+            store.save(archived)
+        
+        archived_ids = homework_repo.delete_many([h['id'] for items in by_month.values() for h in items])
+        if archived_ids:
+            notify_homework_change('deleted', archived_ids)
+            log_operation("归档作业", {"ids": archived_ids, "months": sorted(by_month)}, 'system')
+        return archived_ids
+
+    def start(self, interval):
+        """启动后台归档线程（启动时立即执行一次）"""
+        def run():
+            while True:
+                try:
+                    self.archive_expired()
+                except Exception as e:
+                    print(f"作业归档失败: {e}")
+                if interval <= 0:
+                    return
+                time.sleep(interval)
+        
+        if self._thread is None:
+            self._thread = threading.Thread(target=run, name='homework-archive', daemon=True)
+            self._thread.start()
+
+homework_archive = HomeworkArchive(ARCHIVE_DIR)
 
 def save_labels(labels):
     """将标签数据保存到JSON文件"""
-    with open(LABELS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(labels, f, ensure_ascii=False, indent=2)
+    labels_store.save([dict(label) for label in labels])
+    change_log.record('labels')
+
+class LogRotator:
+    """日志文件轮转：按大小或日期切分为 name.YYYY-MM-DD[.N].gz，并按保留数量清理旧分段"""
+
+    def __init__(self, max_bytes, daily, retention):
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.retention = retention
+
+    def should_rotate(self, path, incoming_bytes, now=None):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if st.st_size == 0:
+            return False
+        if self.max_bytes and st.st_size + incoming_bytes > self.max_bytes:
+            return True
+        now = now or datetime.now()
+        return self.daily and datetime.fromtimestamp(st.st_mtime).date() != now.date()
+
+    def _segment_keys(self, path):
+        """返回[((日期, 序号), 分段路径)]，按从旧到新排序"""
+        directory = os.path.dirname(path) or '.'
+        pattern = re.compile(re.escape(os.path.basename(path)) + r'\.(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.gz$')
+        found = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                found.append(((match.group(1), int(match.group(2) or 0)), os.path.join(directory, name)))
+        return sorted(found)
+
+    def segments(self, path):
+        """列出已轮转的压缩分段（从旧到新）"""
+        return [segment for _, segment in self._segment_keys(path)]
+
+    def rotate(self, path):
+        """将当前文件切出为压缩分段，返回分段路径"""
+        day = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d')
+        # 同一天的分段序号递增，保证排序与切分顺序一致
+        numbers = [n for (segment_day, n), _ in self._segment_keys(path) if segment_day == day]
+        n = max(numbers) + 1 if numbers else 0
+        segment = f"{path}.{day}.{n}" if n else f"{path}.{day}"
+        os.replace(path, segment)
+        with open(segment, 'rb') as src, gzip.open(segment + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+        self.prune(path)
+        return segment + '.gz'
+
+    def prune(self, path):
+        """删除超出保留数量的旧分段"""
+        if self.retention <= 0:
+            return
+        for old in self.segments(path)[:-self.retention]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+class LogIndex:
+    """日志文件旁路索引（name.idx）：按小时分桶的起始字节偏移，以及按键字段（如操作类型）的偏移倒排表
+
+    日志追加后由写线程调用refresh只扫描新增的尾部；文件轮转（inode变化）后自动重建。
+    """
+
+    def __init__(self, path, key_field):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.key_field = key_field
+        self._lock = threading.Lock()
+        self._reset()
+        self._inode = None
+        self._pending = 0
+
+    def _reset(self):
+        self._size = 0
+        self._bucket_keys = []     # 有序的小时桶 'YYYY-MM-DD HH'
+        self._bucket_offsets = []  # 每个桶第一行的偏移
+        self._postings = {}        # 键 -> 有序偏移列表
+
+    def _load(self, st):
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = json_loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return
+        if not isinstance(index, dict) or index.get('inode') != st.st_ino or index.get('size', 0) > st.st_size:
+            return
+        self._size = index['size']
+        self._bucket_keys = index['bucket_keys']
+        self._bucket_offsets = index['bucket_offsets']
+        self._postings = index['postings']
+
+    def save(self):
+        """保存旁路索引"""
+        with self._lock:
+            if not self._pending or self._inode is None:
+                return
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps_bytes({
+                    'inode': self._inode,
+                    'size': self._size,
+                    'bucket_keys': self._bucket_keys,
+                    'bucket_offsets': self._bucket_offsets,
+                    'postings': self._postings
+                }))
+            os.replace(tmp_path, self.index_path)
+            self._pending = 0
+
+    def refresh(self):
+        """与日志文件同步：只解析上次之后追加的行"""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                self._inode = None
+                return
+            if st.st_ino != self._inode or st.st_size < self._size:
+                self._reset()
+                self._inode = st.st_ino
+                self._load(st)
+            if st.st_size <= self._size:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._size)
+                offset = self._size
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self._add(offset, line)
+                    offset += len(line)
+            self._pending += offset - self._size
+            self._size = offset
+        if self._pending >= 64 * 1024:
+            self.save()
+
+    def _add(self, offset, line):
+        try:
+            entry = json_loads(line)
+        except json.JSONDecodeError:
+            return
+        bucket = str(entry.get('timestamp', ''))[:13]
+        if not self._bucket_keys or bucket > self._bucket_keys[-1]:
+            self._bucket_keys.append(bucket)
+            self._bucket_offsets.append(offset)
+        key = entry.get(self.key_field)
+        if key is not None:
+            self._postings.setdefault(str(key), []).append(offset)
+
+    def candidates(self, key=None, since=None, until=None):
+        """返回(起始偏移, 结束偏移, 候选偏移列表或None)；None表示需顺序读取区间内所有行"""
+        self.refresh()
+        with self._lock:
+            return self._candidates(key, since, until)
+
+    def _candidates(self, key, since, until):
+        """在持有锁时根据当前索引计算偏移范围"""
+        start = 0
+        end = self._size
+        if since:
+            i = bisect.bisect_left(self._bucket_keys, since[:13])
+            start = self._bucket_offsets[i] if i < len(self._bucket_keys) else self._size
+        if until:
+            # until可以是日期或时间的前缀，前缀相同的桶都包含在内
+            i = bisect.bisect_right(self._bucket_keys, until[:13] + '\uffff')
+            end = self._bucket_offsets[i] if i < len(self._bucket_keys) else self._size
+        if key is None:
+            return start, end, None
+        offsets = self._postings.get(key, [])
+        lo = bisect.bisect_left(offsets, start)
+        hi = bisect.bisect_left(offsets, end)
+        return start, end, offsets[lo:hi]
+
+    def _open_indexed(self, key, since, until):
+        """在同一把锁内打开日志并确认文件就是索引对应的那个（inode一致且未变短），再计算偏移
+
+        轮转只是重命名旧文件，已打开的文件描述符仍指向旧文件，释放锁后按偏移读取不会错位。
+        返回(文件对象, 起始偏移, 结束偏移, 候选偏移)；文件不存在时返回None。
+        """
+        for _ in range(3):
+            self.refresh()
+            with self._lock:
+                if self._inode is None:
+                    return None
+                try:
+                    f = open(self.path, 'rb')
+                except FileNotFoundError:
+                    continue
+                st = os.fstat(f.fileno())
+                if st.st_ino == self._inode and st.st_size >= self._size:
+                    return (f,) + self._candidates(key, since, until)
+                f.close()  # 刷新索引与打开文件之间发生了轮转，重新同步
+        return None
+
+    def read(self, key=None, since=None, until=None):
+        """按索引定位读取日志行（原始字节）"""
+        opened = self._open_indexed(key, since, until)
+        if opened is None:
+            return
+        f, start, end, offsets = opened
+        with f:
+            if start >= end:
+                return
+            if offsets is not None:
+                for offset in offsets:
+                    f.seek(offset)
+                    yield f.readline()
+                return
+            f.seek(start)
+            position = start
+            for line in f:
+                position += len(line)
+                if position > end:
+                    break
+                yield line
+
+class AsyncLogWriter:
+    """后台批量日志写入：请求线程只把日志行放入有界队列，写线程按条数或时间成批追加到文件
+
+    队列满时丢弃新日志并计数；进程退出时（atexit）写完队列中剩余的日志。
+    """
+
+    STOP = object()
+
+    def __init__(self, max_queue, batch_size, flush_seconds, fsync_seconds, rotator=None, indexes=None):
+        self._queue = queue.Queue(max_queue)
+        self.rotator = rotator
+        self.indexes = indexes or {}  # 路径 -> LogIndex，写入后更新
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.fsync_seconds = fsync_seconds
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._last_fsync = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.rotations = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+
+    def write(self, path, line):
+        """追加一行日志，返回是否已接收（队列满时丢弃并计数）"""
+        if not LOG_ASYNC or self._closed:
+            self._write_lines([(path, line)])
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((path, line))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            # 收集到一批（或遇到刷新/停止请求、或超时）后统一写入
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write_lines([item for item in batch if item[0] is not None])
+            for path, signal in batch:
+                if path is None and signal is not self.STOP:
+                    signal.set()
+            if batch[-1] == (None, self.STOP):
+                return
+
+    def _write_lines(self, items):
+        """按文件分组，每个文件打开一次写入整批日志"""
+        if not items:
+            return
+        grouped = {}
+        for path, line in items:
+            grouped.setdefault(path, []).append(line)
+        with self._write_lock:
+            now = time.monotonic()
+            do_fsync = self.fsync_seconds == 0 or (0 < self.fsync_seconds <= now - self._last_fsync)
+            for path, lines in grouped.items():
+                data = ''.join(lines)
+                try:
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    if self.rotator is not None and self.rotator.should_rotate(path, len(data.encode('utf-8'))):
+                        self.rotator.rotate(path)
+                        self.rotations += 1
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(data)
+                        if do_fsync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    self.written += len(lines)
+                    if path in self.indexes:
+                        self.indexes[path].refresh()
+                except OSError as e:
+                    self.errors += 1
+                    print(f"写入日志失败({path}): {e}", file=sys.stderr)
+            if do_fsync:
+                self._last_fsync = now
+            self.batches += 1
+
+    def flush(self, timeout=5):
+        """等待队列中已有的日志写入文件"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5):
+        """停止写线程并写完剩余日志，之后的日志改为同步写入"""
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put((None, self.STOP), timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        # 写线程未能及时退出时，在当前线程写完剩余日志
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] is not None:
+                remaining.append(item)
+        self._write_lines(remaining)
+        if self.dropped:
+            print(f"日志队列溢出，共丢弃{self.dropped}条日志", file=sys.stderr)
+
+    def stats(self):
+        """返回写入统计"""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+            "rotations": self.rotations
+        }
+
+log_rotator = LogRotator(int(LOG_ROTATE_MB * 1024 * 1024), LOG_ROTATE_DAILY, LOG_RETENTION)
+log_indexes = {
+    LOG_FILE: LogIndex(LOG_FILE, 'operation'),
+    LOGIN_LOG_FILE: LogIndex(LOGIN_LOG_FILE, 'name')
+}
+# atexit按注册的逆序执行：先停止写线程写完日志，再保存索引
+for _log_index in log_indexes.values():
+    atexit.register(_log_index.save)
+log_writer = AsyncLogWriter(LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_SECONDS, LOG_FSYNC_SECONDS, log_rotator, log_indexes)
+atexit.register(log_writer.close)
+
+def query_log(path, key=None, ip=None, user=None, since=None, until=None, contains=None, include_rotated=False):
+    """按条件查询日志，逐条产出匹配的记录；有键或时间条件时通过旁路索引直接定位"""
+    def matches(entry):
+        timestamp = entry.get('timestamp', '')
+        if since and timestamp < since:
+            return False
+        if until and timestamp[:len(until)] > until:
+            return False
+        if ip and entry.get('ip_address') != ip:
+            return False
+        if user:
+            details = entry.get('details') if isinstance(entry.get('details'), dict) else {}
+            names = (entry.get('name'), entry.get('student_id'), entry.get('user_identifier'),
+                     details.get('name'), details.get('student_id'))
+            if user not in names:
+                return False
+        return True
+    
+    def parse(lines):
+        for line in lines:
+            if contains and contains.encode('utf-8') not in line:
+                continue
+            try:
+                entry = json_loads(line)
+            except json.JSONDecodeError:
+                continue
+            if key is not None and str(entry.get(log_indexes[path].key_field)) != key:
+                continue
+            if matches(entry):
+                yield entry
+    
+    if include_rotated:
+        # 已轮转的压缩分段没有索引，按文件名中的日期跳过范围外的分段后顺序扫描
+        for segment in log_rotator.segments(path):
+            day = os.path.basename(segment)[len(os.path.basename(path)) + 1:][:10]
+            if since and day < since[:10]:
+                continue
+            with gzip.open(segment, 'rb') as f:
+                yield from parse(f)
+    yield from parse(log_indexes[path].read(key, since, until))
 
 def log_operation(operation, details, ip_address):
     """记录操作日志到文件"""
@@ -108,15 +1630,7 @@ def log_operation(operation, details, ip_address):
         "details": details,
         "ip_address": ip_address
     }
-    
-    # 确保日志目录存在
-    log_dir = os.path.dirname(LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    # 追加写入日志
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    log_writer.write(LOG_FILE, json_dumps(log_entry) + '\n')
 
 def log_login(name, student_id, ip_address):
     """记录登录日志到文件"""
@@ -126,94 +1640,529 @@ def log_login(name, student_id, ip_address):
         "student_id": student_id,
         "ip_address": ip_address
     }
-    
-    # 确保日志目录存在
-    log_dir = os.path.dirname(LOGIN_LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    # 追加写入日志
-    with open(LOGIN_LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    log_writer.write(LOGIN_LOG_FILE, json_dumps(log_entry) + '\n')
 
-def log_input(content, name, student_id, ip_address, anonymous):
-    """记录用户输入到文件"""
-    # 加载现有数据
-    if os.path.exists(INPUT_LOG_FILE):
-        with open(INPUT_LOG_FILE, 'r', encoding='utf-8') as f:
+class JsonlInputStore:
+    """留言板输入的追加式JSONL存储：每行一条记录（带自增id），删除追加墓碑行
+
+    旁路索引文件记录每条记录的字节偏移、下一个id与已覆盖的文件长度；索引落后于数据文件时
+    只扫描新增的尾部。墓碑累积到阈值后在后台线程压缩。
+    """
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self._lock = threading.RLock()
+        self._offsets = {}      # id -> 字节偏移（仅有效记录）
+        self._records = None    # id -> 记录，首次读取全部记录时才加载
+        self._next_id = 1
+        self._tombstones = 0
+        self._size = 0          # 已解析的文件长度
+        self._inode = None
+        self._pending_index = 0
+        self._compacting = False
+
+    def _file_stat(self):
+        try:
+            return os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+    def _reset(self):
+        self._offsets = {}
+        self._records = None
+        self._next_id = 1
+        self._tombstones = 0
+        self._size = 0
+
+    def _apply_line(self, offset, line, records):
+        """解析一行并更新索引，records不为None时同步更新记录缓存"""
+        try:
+            entry = json_loads(line)
+        except json.JSONDecodeError:
+            return  # 写入中断留下的不完整行
+        entry_id = entry.get('id')
+        if not isinstance(entry_id, int):
+            return
+        self._next_id = max(self._next_id, entry_id + 1)
+        if entry.get('deleted'):
+            if self._offsets.pop(entry_id, None) is not None:
+                self._tombstones += 1
+            if records is not None:
+                records.pop(entry_id, None)
+        else:
+            self._offsets[entry_id] = offset
+            if records is not None:
+                records[entry_id] = entry
+
+    def _scan(self, start, load_records):
+        """从start偏移开始扫描到文件末尾"""
+        records = self._records if self._records is not None else ({} if load_records else None)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # 末尾未写完的行，下次再读
+                if line.strip():
+                    self._apply_line(offset, line, records)
+                offset += len(line)
+        self._size = offset
+        if records is not None:
+            self._records = records
+
+    def _load_index(self, st):
+        """读取旁路索引，仅当其与数据文件匹配时采用"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = json_loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return False
+        if not isinstance(index, dict) or index.get('inode') != st.st_ino or index.get('size', 0) > st.st_size:
+            return False
+        self._offsets = {int(k): v for k, v in index.get('offsets', {}).items()}
+        self._next_id = index.get('next_id', 1)
+        self._tombstones = index.get('tombstones', 0)
+        self._size = index.get('size', 0)
+        return True
+
+    def _index_next_id(self):
+        """读取旁路索引中的next_id（不要求与数据文件匹配：id只增不减，旧索引的值也是有效下界）"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = json_loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return 1
+        next_id = index.get('next_id', 1) if isinstance(index, dict) else 1
+        return next_id if isinstance(next_id, int) else 1
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumps_bytes({
+                'inode': self._inode,
+                'size': self._size,
+                'next_id': self._next_id,
+                'tombstones': self._tombstones,
+                'offsets': self._offsets
+            }))
+        os.replace(tmp_path, self.index_path)
+        self._pending_index = 0
+
+    def _refresh(self, load_records=False):
+        """与数据文件同步：文件被替换或截断时重建，追加时只读新增部分"""
+        st = self._file_stat()
+        if st is None:
+            self._reset()
+            self._inode = None
+            if load_records:
+                self._records = {}
+            return
+        if st.st_ino != self._inode or st.st_size < self._size:
+            self._reset()
+            self._inode = st.st_ino
+            if load_records or not self._load_index(st):
+                # 压缩可能删掉了最大id的墓碑，只靠扫描会复用已删除的id，以索引中的next_id为下界
+                self._next_id = self._index_next_id()
+        if load_records and self._records is None:
+            self._offsets = {}
+            self._next_id = max(self._next_id, self._index_next_id())
+            self._tombstones = 0
+            self._scan(0, True)
+        elif st.st_size > self._size:
+            self._scan(self._size, load_records)
+
+    def migrate_legacy(self):
+        """将旧版JSON数组格式的input.log转换为JSONL（原文件备份为.json.bak），返回迁移条数"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if not data.lstrip().startswith(b'['):
+                return 0
             try:
-                inputs = json.load(f)
+                entries = json_loads(data)
             except json.JSONDecodeError:
-                inputs = []
-    else:
-        inputs = []
-    
-    # 添加新输入
-    input_entry = {
+                entries = []
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for entry_id, entry in enumerate((e for e in entries if isinstance(e, dict)), 1):
+                    f.write(json_dumps_bytes(dict(entry, id=entry_id)) + b'\n')
+            os.replace(self.path, self.path + '.json.bak')
+            os.replace(tmp_path, self.path)
+            self._reset()
+            self._inode = None
+            self._refresh()
+            self._save_index()
+            return len(entries)
+
+    def append(self, entry):
+        """追加一条记录并分配id，返回保存后的记录"""
+        with self._lock:
+            self._refresh()
+            entry = dict(entry, id=self._next_id)
+            self._write_line(entry)
+            self._offsets[entry['id']] = self._last_offset
+            if self._records is not None:
+                self._records[entry['id']] = entry
+            self._next_id += 1
+            return entry
+
+    def _write_line(self, entry):
+        with open(self.path, 'ab') as f:
+            self._last_offset = f.tell()
+            f.write(json_dumps_bytes(entry) + b'\n')
+            self._size = f.tell()
+        if self._inode is None:
+            self._inode = os.stat(self.path).st_ino
+        self._pending_index += 1
+        if self._pending_index >= INPUT_INDEX_SAVE_EVERY:
+            self._save_index()
+
+    def get(self, entry_id):
+        """按id读取一条有效记录（通过偏移索引直接定位），不存在时返回None"""
+        with self._lock:
+            self._refresh()
+            if self._records is not None:
+                entry = self._records.get(entry_id)
+                return dict(entry) if entry is not None else None
+            offset = self._offsets.get(entry_id)
+            if offset is None:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return json_loads(f.readline())
+
+    def all(self):
+        """返回全部有效记录（副本，按写入顺序）"""
+        with self._lock:
+            self._refresh(load_records=True)
+            return [dict(entry) for entry in self._records.values()]
+
+    def delete(self, entry_id):
+        """追加墓碑行删除一条记录，墓碑达到阈值时触发后台压缩"""
+        with self._lock:
+            self._refresh()
+            if entry_id not in self._offsets:
+                return False
+            self._write_line({'id': entry_id, 'deleted': True, 'deleted_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+            del self._offsets[entry_id]
+            if self._records is not None:
+                self._records.pop(entry_id, None)
+            self._tombstones += 1
+            if self._tombstones >= INPUT_COMPACT_THRESHOLD and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, name='input-compact', daemon=True).start()
+            return True
+
+    def compact(self):
+        """重写数据文件，只保留有效记录，返回清除的墓碑数"""
+        with self._lock:
+            try:
+                self._refresh(load_records=True)
+                removed = self._tombstones
+                if not removed:
+                    return 0
+                tmp_path = self.path + '.tmp'
+                offsets = {}
+                with open(tmp_path, 'wb') as f:
+                    for entry_id, entry in self._records.items():
+                        offsets[entry_id] = f.tell()
+                        f.write(json_dumps_bytes(entry) + b'\n')
+                    size = f.tell()
+                os.replace(tmp_path, self.path)
+                self._offsets = offsets
+                self._tombstones = 0
+                self._size = size
+                self._inode = os.stat(self.path).st_ino
+                # 压缩后的文件丢失了最大id的墓碑，把next_id写进索引，保证id不复用
+                self._save_index()
+                return removed
+            finally:
+                self._compacting = False
+
+    def flush_index(self):
+        """保存旁路索引（进程退出时调用）"""
+        with self._lock:
+            if self._pending_index and self._inode is not None:
+                self._save_index()
+
+input_store = JsonlInputStore(INPUT_LOG_FILE, INPUT_INDEX_FILE)
+atexit.register(input_store.flush_index)
+
+def log_input(content, name, student_id, ip_address, anonymous):
+    """记录用户输入到文件（追加一行JSONL），并计入提交限流"""
+    submit_limiter.hit((name, student_id))
+    return input_store.append({
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "content": content,
         "name": name,
         "student_id": student_id,
         "ip_address": ip_address,
         "anonymous": anonymous
-    }
-    
-    inputs.append(input_entry)
-    
-    # 保存数据
-    with open(INPUT_LOG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(inputs, f, ensure_ascii=False, indent=2)
+    })
+
+def load_inputs():
+    """从文件加载所有用户输入"""
+    return input_store.all()
+
+class SlidingWindowLimiter:
+    """按键的滑动窗口限流：每个键保存最近请求时间（epoch秒）的deque，只保留最大窗口内的记录
+
+    判断某条规则时只需查看倒数第limit条记录是否仍在窗口内，与历史长度无关。
+    """
+
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda rule: rule['window'])
+        self.max_window = max(rule['window'] for rule in self.rules)
+        self.max_limit = max(rule['limit'] for rule in self.rules)
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        while hits and hits[0] <= now - self.max_window:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def check(self, key, now=None):
+        """返回被触发的规则（不记录本次请求），未触发时返回None"""
+        now = now if now is not None else time.time()
+        with self._lock:
+            hits = self._prune(key, now)
+            if hits is None:
+                return None
+            for rule in self.rules:
+                if len(hits) >= rule['limit'] and hits[-rule['limit']] > now - rule['window']:
+                    return rule
+            return None
+
+    def hit(self, key, now=None):
+        """记录一次请求"""
+        now = now if now is not None else time.time()
+        with self._lock:
+            hits = self._hits.setdefault(key, deque())
+            hits.append(now)
+            # 超过最大次数的旧记录不会再影响任何规则
+            while len(hits) > self.max_limit:
+                hits.popleft()
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._hits), "entries": sum(len(hits) for hits in self._hits.values())}
+
+submit_limiter = SlidingWindowLimiter(RATE_LIMIT_POLICIES['fun_submit'])
+
+class TokenBucketStore:
+    """令牌桶配额存储：db_file为None时保存在进程内存，否则保存在SQLite中供多个worker共享"""
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._buckets = {}  # (桶名, 键) -> (剩余令牌, 更新时间)
+        self._local = threading.local()
+        if db_file:
+            self._connect().execute(
+                'CREATE TABLE IF NOT EXISTS token_buckets ('
+                'bucket TEXT NOT NULL, key TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                'PRIMARY KEY (bucket, key))')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _refill(state, capacity, period, now):
+        if state is None:
+            return float(capacity)
+        tokens, updated = state
+        return min(float(capacity), tokens + (now - updated) * capacity / period)
+
+    def consume(self, bucket, key, capacity, period, amount=1, allow_debt=False, now=None):
+        """取出amount个令牌，令牌不足时不扣除并返回False；allow_debt为True时总是扣除（可透支）"""
+        now = now if now is not None else time.time()
+        if not self.db_file:
+            with self._lock:
+                tokens = self._refill(self._buckets.get((bucket, key)), capacity, period, now)
+                ok = allow_debt or tokens >= amount
+                self._buckets[(bucket, key)] = (tokens - amount if ok else tokens, now)
+                return ok
+        
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM token_buckets WHERE bucket = ? AND key = ?', (bucket, key)).fetchone()
+            tokens = self._refill(row, capacity, period, now)
+            ok = allow_debt or tokens >= amount
+            conn.execute('INSERT OR REPLACE INTO token_buckets (bucket, key, tokens, updated) VALUES (?, ?, ?, ?)',
+                         (bucket, key, tokens - amount if ok else tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return ok
+
+    def available(self, bucket, key, capacity, period, now=None):
+        """返回当前剩余令牌数（不扣除）"""
+        now = now if now is not None else time.time()
+        if not self.db_file:
+            with self._lock:
+                return self._refill(self._buckets.get((bucket, key)), capacity, period, now)
+        row = self._connect().execute(
+            'SELECT tokens, updated FROM token_buckets WHERE bucket = ? AND key = ?', (bucket, key)).fetchone()
+        return self._refill(row, capacity, period, now)
+
+ai_quota_store = TokenBucketStore(AI_LIMIT_DB_FILE if AI_LIMIT_BACKEND == 'sqlite' else None)
+
+def seed_submit_limiter():
+    """启动时用输入记录重建提交限流状态"""
+    cutoff = time.time() - submit_limiter.max_window
+    for entry in input_store.all():
+        try:
+            submitted_at = datetime.strptime(entry['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+        except (KeyError, TypeError, ValueError):
+            continue
+        if submitted_at > cutoff:
+            submit_limiter.hit((entry.get('name'), entry.get('student_id')), submitted_at)
+
+def check_submit_limit(name, student_id):
+    """检查用户提交限制，超出限制时返回提示信息，否则返回None"""
+    rule = submit_limiter.check((name, student_id))
+    return rule['message'] if rule else None
+
+class CredentialStore:
+    """学生密码存储：SQLite按学号单条更新，密码加盐PBKDF2哈希保存；未设置密码的学生使用默认密码"""
+
+    def __init__(self, db_file, iterations=PASSWORD_HASH_ITERATIONS, cache_ttl=PASSWORD_CACHE_TTL, cache_size=PASSWORD_CACHE_SIZE):
+        self.db_file = db_file
+        self.iterations = iterations
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 验证缓存：(学号, 密码的进程内HMAC) -> (哈希值, 过期时间)，不保存明文密码
+        self._cache = OrderedDict()
+        self._cache_secret = os.urandom(16)
+        self.cache_hits = 0
+        self.hash_checks = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS credentials ('
+            'student_id TEXT PRIMARY KEY, salt BLOB NOT NULL, hash BLOB NOT NULL, '
+            'iterations INTEGER NOT NULL, updated REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash(password, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+    def _row(self, student_id):
+        return self._connect().execute(
+            'SELECT salt, hash, iterations FROM credentials WHERE student_id = ?', (student_id,)).fetchone()
+
+    def has_password(self, student_id):
+        """是否设置了自定义密码"""
+        return self._row(student_id) is not None
+
+    def verify(self, student_id, password):
+        """验证密码：未设置自定义密码时与默认密码比较；成功结果在TTL内缓存，密码变更后缓存自动失效"""
+        row = self._row(student_id)
+        if row is None:
+            return hmac.compare_digest(password.encode('utf-8'), get_default_password().encode('utf-8'))
+        salt, stored, iterations = row
+        key = (student_id, hmac.new(self._cache_secret, password.encode('utf-8'), 'sha256').digest())
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            # 缓存记录的是当时的哈希值，其他worker修改密码后哈希不同，缓存自然不再命中
+            if cached and cached[1] > now and cached[0] == stored:
+                self.cache_hits += 1
+                return True
+        self.hash_checks += 1
+        ok = hmac.compare_digest(self._hash(password, salt, iterations), stored)
+        if ok and self.cache_ttl > 0:
+            with self._lock:
+                self._cache[key] = (stored, now + self.cache_ttl)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return ok
 
-def load_inputs():
-    """从文件加载所有用户输入"""
-    if os.path.exists(INPUT_LOG_FILE):
-        with open(INPUT_LOG_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+    def set_password(self, student_id, password):
+        """设置自定义密码（只写入该学生一行）"""
+        salt = os.urandom(16)
+        self._connect().execute(
+            'INSERT OR REPLACE INTO credentials (student_id, salt, hash, iterations, updated) VALUES (?, ?, ?, ?, ?)',
+            (student_id, salt, self._hash(password, salt, self.iterations), self.iterations, time.time()))
+        self._forget(student_id)
 
-def check_submit_limit(name, student_id):
-    """检查用户提交限制"""
-    inputs = load_inputs()
-    
-    # 获取当前时间和24小时前的时间
-    now = datetime.now()
-    past_24_hours = now - timedelta(hours=24)
-    
-    # 统计用户提交次数
-    user_submissions_24h = []
-    user_submissions_30s = []
-    
-    for input_entry in inputs:
-        # 检查是否是同一用户
-        if input_entry.get('name') == name and input_entry.get('student_id') == student_id:
-            # 解析时间戳
+    def reset_password(self, student_id):
+        """删除自定义密码恢复为默认密码，返回是否删除了记录"""
+        deleted = self._connect().execute('DELETE FROM credentials WHERE student_id = ?', (student_id,)).rowcount > 0
+        self._forget(student_id)
+        return deleted
+
+    def _forget(self, student_id):
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == student_id]:
+                del self._cache[key]
+
+    def migrate_legacy(self, path):
+        """将旧版明文password.json导入数据库（已存在的学号不覆盖），事务提交后删除明文文件
+
+        PASSWORD_KEEP_LEGACY_BACKUP开启时改为重命名为.migrated；未开启时顺带删除以前留下的.migrated明文备份。
+        """
+        if not os.path.exists(path):
+            if not PASSWORD_KEEP_LEGACY_BACKUP and os.path.exists(path + '.migrated'):
+                os.remove(path + '.migrated')
+            return 0
+        with open(path, 'rb') as f:
             try:
-                entry_time = datetime.strptime(input_entry['timestamp'], "%Y-%m-%d %H:%M:%S")
-                
-                # 统计24小时内的提交
-                if entry_time >= past_24_hours:
-                    user_submissions_24h.append(input_entry)
-                    
-                # 统计30秒内的提交
-                if entry_time >= now - timedelta(seconds=30):
-                    user_submissions_30s.append(input_entry)
-            except ValueError:
-                # 时间戳格式不正确，跳过该条目
-                continue
-    
-    # 返回检查结果
-    return {
-        'within_30s': len(user_submissions_30s) >= 1,  # 30秒内是否有提交
-        'within_24h': len(user_submissions_24h) >= 15  # 24小时内是否达到上限
-    }
+                data = json_loads(f.read())
+            except json.JSONDecodeError:
+                data = {}
+        rows = []
+        for student_id, password in (data.items() if isinstance(data, dict) else []):
+            student_id = str(student_id).strip()
+            if student_id and isinstance(password, str) and not self.has_password(student_id):
+                salt = os.urandom(16)
+                rows.append((student_id, salt, self._hash(password, salt, self.iterations), self.iterations, time.time()))
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO credentials (student_id, salt, hash, iterations, updated) VALUES (?, ?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if PASSWORD_KEEP_LEGACY_BACKUP:
+            os.replace(path, path + '.migrated')
+        else:
+            os.remove(path)
+            if os.path.exists(path + '.migrated'):
+                os.remove(path + '.migrated')
+        return len(rows)
 
-def save_password_data():
-    """保存密码数据到文件"""
-    with open(PASSWORD_FILE, 'w', encoding='utf-8') as f:
-        json.dump(password_data, f, ensure_ascii=False, indent=4)
+    def stats(self):
+        with self._lock:
+            return {"cached": len(self._cache), "cache_hits": self.cache_hits, "hash_checks": self.hash_checks}
 
 def get_default_password():
     """获取默认密码"""
@@ -227,8 +2176,6 @@ def validate_password(password):
 
 def log_prompt_operation(operation, details, user_identifier, ip_address):
     """记录提示词操作日志到文件"""
-    PROMPT_LOG_FILE = os.path.join(DATA_DIR, 'prompt.log')
-    
     log_entry = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "operation": operation,
@@ -236,77 +2183,169 @@ def log_prompt_operation(operation, details, user_identifier, ip_address):
         "user_identifier": user_identifier,
         "ip_address": ip_address
     }
-    
-    # 确保日志目录存在
-    log_dir = os.path.dirname(PROMPT_LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    # 追加写入日志
-    with open(PROMPT_LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    log_writer.write(PROMPT_LOG_FILE, json_dumps(log_entry) + '\n')
 
 # 初始化数据
-submissions = load_submissions()
+submissions = homework_repo.all()
 
-if os.path.exists(IP_FILE):
-    with open(IP_FILE, 'r', encoding='utf-8') as f:
-        try:
-            data_ip = json.load(f)
-        except json.JSONDecodeError:
-            pass
+class StudentDirectory:
+    """学生名单目录：加载时一次性规范化姓名/学号并建立索引，students.json变化时自动重建"""
+
+    DEFAULT_STUDENTS = {"张三": "2023001", "李四": "2023002"}
+    NAME_HEADERS = ('姓名', 'name')
+    ID_HEADERS = ('学号', 'student_id', 'id')
+
+    def __init__(self, store):
+        self.store = store
+        self.table = LookupTable(store, self.build)
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def normalize_name(name):
+        """姓名规范化：全角转半角并去除所有空白"""
+        if name is None:
+            return ''
+        return ''.join(unicodedata.normalize('NFKC', str(name)).split())
+
+    @staticmethod
+    def normalize_id(student_id):
+        """学号规范化：全角转半角并去除首尾空白，Excel中的数字学号去掉小数部分"""
+        if student_id is None:
+            return ''
+        if isinstance(student_id, float) and student_id.is_integer():
+            student_id = int(student_id)
+        return unicodedata.normalize('NFKC', str(student_id)).strip()
+
+    @classmethod
+    def to_mapping(cls, data):
+        """将文件数据统一为 {姓名: 学号}，兼容旧版列表格式"""
+        if isinstance(data, list):
+            return {item.get('name', ''): item.get('student_id', '') for item in data if isinstance(item, dict)}
+        if isinstance(data, dict):
+            return data
+        return {}
+
+    @classmethod
+    def build(cls, data):
+        """构建索引：by_name（姓名→学号列表）、by_id（学号→姓名）、by_pair（(姓名,学号)集合）"""
+        by_name, by_id, by_pair = {}, {}, set()
+        for stored_name, stored_id in cls.to_mapping(data).items():
+            name = cls.normalize_name(stored_name)
+            student_id = cls.normalize_id(stored_id)
+            if not name or not student_id:
+                continue
+            by_name.setdefault(name, []).append(student_id)
+            by_id[student_id] = name
+            by_pair.add((name, student_id))
+        return {'by_name': by_name, 'by_id': by_id, 'by_pair': by_pair}
+
+    def init_file(self):
+        """启动时检查名单文件：不存在则写入示例，旧版列表或非法格式则修复"""
+        if not os.path.exists(self.store.path):
+            self.store.save(dict(self.DEFAULT_STUDENTS))
+            return
+        data = self.store.load()
+        if isinstance(data, list):
+            self.store.save(self.to_mapping(data))
+        elif data is not None and not isinstance(data, dict):
+            self.store.save(dict(self.DEFAULT_STUDENTS))
+
+    def find(self, name, student_id):
+        """按姓名+学号查找学生，返回规范化后的 (姓名, 学号)，不匹配时返回None"""
+        key = (self.normalize_name(name), self.normalize_id(student_id))
+        return key if key in self.table.get()['by_pair'] else None
+
+    def get_by_id(self, student_id):
+        """按学号查找姓名"""
+        return self.table.get()['by_id'].get(self.normalize_id(student_id))
+
+    def get_by_name(self, name):
+        """按姓名查找学号列表（可能重名）"""
+        return list(self.table.get()['by_name'].get(self.normalize_name(name), []))
+
+    def all(self):
+        """返回 {姓名: 学号} 副本"""
+        return dict(self.to_mapping(self.store.load()))
+
+    def count(self):
+        return len(self.table.get()['by_pair'])
+
+    @classmethod
+    def iter_rows(cls, file_storage):
+        """流式逐行读取上传的CSV/XLSX名单文件，返回行迭代器"""
+        filename = (file_storage.filename or '').lower()
+        if filename.endswith('.xlsx'):
+            if openpyxl is None:
+                raise ValueError('服务器未安装openpyxl，请上传CSV文件')
+            workbook = openpyxl.load_workbook(file_storage.stream, read_only=True, data_only=True)
+            return workbook.active.iter_rows(values_only=True)
+        if filename.endswith('.csv'):
+            return csv.reader(io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline=''))
+        raise ValueError('仅支持CSV或XLSX文件')
+
+    @classmethod
+    def parse_rows(cls, rows):
+        """解析名单行：首行含“姓名/学号”表头时按表头定位列，否则默认第1列姓名、第2列学号"""
+        name_col, id_col = 0, 1
+        records, errors = [], []
+        for line_no, row in enumerate(rows, start=1):
+            cells = list(row or ())
+            if line_no == 1:
+                headers = [str(cell).strip().lower() if cell is not None else '' for cell in cells]
+                name_hits = [i for i, h in enumerate(headers) if h in cls.NAME_HEADERS]
+                id_hits = [i for i, h in enumerate(headers) if h in cls.ID_HEADERS]
+                if name_hits and id_hits:
+                    name_col, id_col = name_hits[0], id_hits[0]
+                    continue
+            if not any(cell not in (None, '') for cell in cells):
+                continue
+            name = cls.normalize_name(cells[name_col] if name_col < len(cells) else None)
+            student_id = cls.normalize_id(cells[id_col] if id_col < len(cells) else None)
+            if not name or not student_id:
+                errors.append({"line": line_no, "error": "姓名或学号为空"})
+                continue
+            records.append((name, student_id))
+        return records, errors
+
+    def import_records(self, records, replace=False):
+        """合并或替换名单，只写一次文件；姓名或学号冲突时以后出现的记录为准"""
+        with self._write_lock:
+            current = {} if replace else {
+                self.normalize_name(n): self.normalize_id(i) for n, i in self.all().items()
+                if self.normalize_name(n) and self.normalize_id(i)
+            }
+            owner = {student_id: name for name, student_id in current.items()}
+            added = updated = unchanged = 0
+            for name, student_id in records:
+                prev_id = current.get(name)
+                prev_name = owner.get(student_id)
+                if prev_id == student_id:
+                    unchanged += 1
+                elif prev_id is None and prev_name is None:
+                    added += 1
+                else:
+                    updated += 1
+                if prev_name is not None and prev_name != name:
+                    current.pop(prev_name, None)
+                if prev_id is not None and prev_id != student_id:
+                    owner.pop(prev_id, None)
+                current[name] = student_id
+                owner[student_id] = name
+            self.store.save(current)
+        return {"added": added, "updated": updated, "unchanged": unchanged, "total": len(current)}
+
+student_directory = StudentDirectory(students_store)
 
 # 初始化学生数据
-if os.path.exists(STUDENTS_FILE):
-    with open(STUDENTS_FILE, 'r', encoding='utf-8') as f:
-        try:
-            students_data = json.load(f)
-            # 确保students_data是字典类型
-            if isinstance(students_data, list):
-                # 如果是列表，转换为字典格式
-                students_data = {item.get('name', ''): item.get('student_id', '') for item in students_data if isinstance(item, dict)}
-                # 保存修复后的数据
-                with open(STUDENTS_FILE, 'w', encoding='utf-8') as f_save:
-                    json.dump(students_data, f_save, ensure_ascii=False, indent=4)
-            elif not isinstance(students_data, dict):
-                # 如果既不是字典也不是列表，使用默认数据
-                students_data = {
-                    "张三": "2023001",
-                    "李四": "2023002"
-                }
-                with open(STUDENTS_FILE, 'w', encoding='utf-8') as f_save:
-                    json.dump(students_data, f_save, ensure_ascii=False, indent=4)
-        except json.JSONDecodeError:
-            students_data = {}
-else:
-    # 如果没有学生数据文件，创建一个示例
-    students_data = {
-        "张三": "2023001",
-        "李四": "2023002"
-    }
-    with open(STUDENTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(students_data, f, ensure_ascii=False, indent=4)
+student_directory.init_file()
 
-# 初始化输入数据文件
-if not os.path.exists(INPUT_LOG_FILE):
-    with open(INPUT_LOG_FILE, 'w', encoding='utf-8') as f:
-        json.dump([], f, ensure_ascii=False, indent=4)
+# 初始化输入数据文件（旧版JSON数组格式自动迁移为JSONL）
+input_store.migrate_legacy()
+seed_submit_limiter()
 
-# 初始化密码数据
-if os.path.exists(PASSWORD_FILE):
-    with open(PASSWORD_FILE, 'r', encoding='utf-8') as f:
-        try:
-            password_data = json.load(f)
-            # 确保password_data是字典类型
-            if not isinstance(password_data, dict):
-                password_data = {}
-        except json.JSONDecodeError:
-            password_data = {}
-else:
-    # 如果没有密码文件，创建一个空的
-    password_data = {}
-    with open(PASSWORD_FILE, 'w', encoding='utf-8') as f:
-        json.dump(password_data, f, ensure_ascii=False, indent=4)
+# 初始化密码数据（旧版明文password.json迁移到哈希存储）
+credential_store = CredentialStore(CREDENTIALS_DB_FILE)
+credential_store.migrate_legacy(PASSWORD_FILE)
 
 @app.route('/')
 def homepage():
@@ -329,48 +2368,240 @@ def countdown_page():
     return render_template('countdown.html')
 
 
+class IpPrefixTrie:
+    """IP前缀树：IPv4/IPv6各一棵二叉树，查找时沿地址位向下走，返回最长匹配的规则"""
+
+    def __init__(self):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}  # 节点：[0分支, 1分支, 规则]
+
+    def add(self, rule):
+        """加入一条规则（单个IP或CIDR），格式错误时返回False"""
+        try:
+            network = ipaddress.ip_network(rule.strip(), strict=False)
+        except (ValueError, AttributeError):
+            return False
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (bits >> (network.max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = rule
+        return True
+
+    def match(self, ip):
+        """返回匹配的规则，未匹配或IP格式错误时返回None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        node = self._roots[address.version]
+        bits = int(address)
+        matched = node[2]
+        for i in range(address.max_prefixlen):
+            node = node[(bits >> (address.max_prefixlen - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                matched = node[2]
+        return matched
+
+class IpPolicy:
+    """IP访问策略：ips.json中的banned_ips与admin_ips（支持CIDR）编译为前缀树
+
+    ips.json变化后自动重新编译；每条规则的命中次数跨重载保留。
+    """
+
+    LISTS = ('banned_ips', 'admin_ips')
+
+    def __init__(self, store):
+        self._tables = LookupTable(store, self.compile)
+        self._lock = threading.Lock()
+        self.hits = {name: {} for name in self.LISTS}
+
+    @classmethod
+    def compile(cls, data):
+        tables = {}
+        for name in cls.LISTS:
+            trie = IpPrefixTrie()
+            entries = data.get(name, []) if isinstance(data, dict) else []
+            for rule in entries:
+                if not trie.add(rule):
+                    print(f"ips.json中的{name}规则无效，已忽略: {rule}", file=sys.stderr)
+            tables[name] = trie
+        return tables
+
+    def match(self, name, ip):
+        """返回ip在指定名单中命中的规则（并计数），未命中返回None"""
+        rule = self._tables.get()[name].match(ip)
+        if rule is not None:
+            with self._lock:
+                self.hits[name][rule] = self.hits[name].get(rule, 0) + 1
+        return rule
+
+    def is_banned(self, ip):
+        return self.match('banned_ips', ip) is not None
+
+    def is_admin(self, ip):
+        return ip == '127.0.0.1' or self.match('admin_ips', ip) is not None
+
+    def stats(self):
+        """返回各名单当前规则及命中次数"""
+        data = ip_store.load()
+        with self._lock:
+            return {
+                name: {rule: self.hits[name].get(rule, 0) for rule in (data.get(name, []) if isinstance(data, dict) else [])}
+                for name in self.LISTS
+            }
+
+ip_policy = IpPolicy(ip_store)
+
+trusted_proxies = IpPrefixTrie()
+for _proxy_rule in TRUSTED_PROXIES.split(','):
+    if _proxy_rule.strip():
+        trusted_proxies.add(_proxy_rule)
+
 @staticmethod # 静态方法，避免每次请求都创建实例
 @app.before_request
 def check_banned_ip():
     """拦截禁止访问的IP"""
-    global data_ip
     user_ip = get_client_ip() # 获取用户IP地址
-    banned_ips = data_ip.get('banned_ips', [])
-    if user_ip in banned_ips:
+    if ip_policy.is_banned(user_ip):
         return "<br><br><h3>您的IP已被禁止访问，如有疑问，请联系开发者。</h3>", 403
 def get_client_ip():
     """
     获取客户端真实IP地址
-    无论是否使用代理服务器，都尝试获取最可靠的客户端IP
+    只有直连地址是可信代理（TRUSTED_PROXIES）时才读取代理头部，否则直接使用REMOTE_ADDR
     """
-    # 首先检查常见的代理相关头部
-    if request.headers.get('X-Forwarded-For'):
-        # X-Forwarded-For格式: client_ip, proxy1_ip, proxy2_ip...
-        # 最左侧的是原始客户端IP
-        ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
-        if ip and ip != 'unknown':
-            # app.logger.info(f"Got IP from X-Forwarded-For: {ip}")
+    remote_ip = request.remote_addr or 'unknown'
+    if trusted_proxies.match(remote_ip) is None:
+        return remote_ip
+    
+    # X-Forwarded-For格式: client_ip, proxy1_ip, proxy2_ip...
+    # 左侧的条目可以被客户端伪造，从右往左跳过可信代理，第一个不可信的地址才是真实客户端
+    forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',')]
+    forwarded = [ip for ip in forwarded if ip and ip != 'unknown']
+    for ip in reversed(forwarded):
+        if trusted_proxies.match(ip) is None:
             return ip
+    if forwarded:
+        return forwarded[0]
     
-    # 检查X-Real-IP头部
-    if request.headers.get('X-Real-IP'):
-        ip = request.headers.get('X-Real-IP')
+    # 检查X-Real-IP及其他可能的代理头部
+    for header in ['X-Real-IP', 'X-Client-IP', 'X-ProxyUser-Ip', 'CF-Connecting-IP', 'True-Client-IP']:
+        ip = request.headers.get(header)
         if ip and ip != 'unknown':
-            # app.logger.info(f"Got IP from X-Real-IP: {ip}")
             return ip
     
-    # 检查其他可能的代理头部
-    for header in ['X-Client-IP', 'X-ProxyUser-Ip', 'CF-Connecting-IP', 'True-Client-IP']:
-        if request.headers.get(header):
-            ip = request.headers.get(header)
-            if ip and ip != 'unknown':
-                # app.logger.info(f"Got IP from {header}: {ip}")
-                return ip
-    
     # 最后使用REMOTE_ADDR作为兜底方案
-    ip = request.remote_addr or 'unknown'
-    # app.logger.info(f"Using REMOTE_ADDR: {ip}")
-    return ip
+    return remote_ip
+
+def make_etag(*versions):
+    """根据各数据文件版本计算强ETag"""
+    return hashlib.sha1('|'.join(versions).encode('utf-8')).hexdigest()[:20]
+
+def etag_matches(etag):
+    """If-None-Match是否命中etag（包括压缩后的-gzip/-br变体）"""
+    if_none_match = request.if_none_match
+    return any(if_none_match.contains(candidate) for candidate in (etag, etag + '-gzip', etag + '-br'))
+
+def conditional_json_response(compute_etag, build_payload):
+    """If-None-Match命中时直接返回304，否则才构建并序列化响应
+
+    compute_etag为无参函数：构建过程可能写入默认数据文件（如标签、科目），构建后重新计算ETag，
+    保证返回的ETag对应实际数据版本。
+    """
+    etag = compute_etag()
+    if etag_matches(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+        etag = compute_etag()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+class CompressionCache:
+    """按（数据版本, 编码）缓存压缩结果，同一版本的热点响应只压缩一次"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compress(self, key, encoding, data):
+        cache_key = (key, encoding)
+        with self._lock:
+            if cache_key in self._items:
+                self._items.move_to_end(cache_key)
+                self.hits += 1
+                return self._items[cache_key]
+        compressed = compress_body(data, encoding)
+        with self._lock:
+            self.misses += 1
+            self._items[cache_key] = compressed
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return compressed
+
+compression_cache = CompressionCache(COMPRESS_CACHE_SIZE)
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+def choose_encoding():
+    """根据Accept-Encoding的q值选择压缩方式（q=0表示拒绝），q值相同时优先br"""
+    accept = request.accept_encodings
+    candidates = [('gzip', accept.quality('gzip'))]
+    if brotli is not None:
+        candidates.insert(0, ('br', accept.quality('br')))
+    encoding, quality = max(candidates, key=lambda item: item[1])
+    return encoding if quality > 0 else None
+
+@app.after_request
+def compress_response(response):
+    """压缩JSON接口与页面响应；SSE和流式响应（如AI对话）保持原样"""
+    if response.status_code == 304:
+        # 304需要返回与200相同的编码变体ETag及Vary，缓存才能继续使用已保存的表示
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.vary.add('Accept-Encoding')
+            encoding = choose_encoding()
+            if encoding and request.if_none_match.contains(f"{etag}-{encoding}"):
+                response.set_etag(f"{etag}-{encoding}")
+        return response
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    min_size = COMPRESS_MIN_SIZE.get(response.mimetype)
+    if min_size is None:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None or (response.content_length or 0) < min_size:
+        return response
+    
+    data = response.get_data()
+    etag, weak = response.get_etag()
+    cache_key = getattr(response, 'compression_key', None) or (etag if etag and not weak else None)
+    if cache_key:
+        compressed = compression_cache.get_or_compress(cache_key, encoding, data)
+    else:
+        compressed = compress_body(data, encoding)
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag and not weak:
+        # 不同编码是不同的表示，强ETag需要区分
+        response.set_etag(f"{etag}-{encoding}")
+    return response
 
 class Homework:
     '''
@@ -384,43 +2615,205 @@ class Homework:
     @app.route('/homework')
     def view_homework():
         # 每次访问时都重新加载数据，确保获取最新数据
-        submissions = load_submissions()
+        grouped_submissions = homework_repo.grouped_by_subject()
         labels = Label.load_labels()
         
-        # 按学科分组作业
-        grouped_submissions = {}
-        for submission in submissions:
-            subject = submission['subject']
-            if subject not in grouped_submissions:
-                grouped_submissions[subject] = []
-            grouped_submissions[subject].append(submission)
-        
         return render_template('homework.html', submissions=grouped_submissions, labels=labels)
     
     @app.route('/api/homework')
     def api_homework():
-        # API端点，返回JSON格式的作业数据
-        submissions = load_submissions()
-        labels = Label.load_labels()
-        
-        # 按学科分组作业
-        grouped_submissions = {}
-        for submission in submissions:
-            subject = submission['subject']
-            if subject not in grouped_submissions:
-                grouped_submissions[subject] = []
-            grouped_submissions[subject].append(submission)
+        # API端点，返回JSON格式的作业数据（支持ETag条件请求）
+        def build_payload():
+            grouped_submissions = homework_repo.grouped_by_subject()
+            labels = Label.load_labels()
+            return {"submissions": grouped_submissions, "labels": labels}
         
-        return jsonify({"submissions": grouped_submissions, "labels": labels})
+        return conditional_json_response(
+            lambda: make_etag('homework', homework_repo.version(), labels_store.version()), build_payload)
 
     @app.route('/api/subjects')
     def api_subjects():
-        # API端点，返回JSON格式的学科顺序数据
-        subjects = Subject.load_subjects()
-        # 按order字段排序
-        subjects.sort(key=lambda x: x.get('order', 999))
-        # 返回学科名称列表，按排序顺序
-        return jsonify([subject['name'] for subject in subjects])
+        # API端点，返回JSON格式的学科顺序数据（支持ETag条件请求）
+        return conditional_json_response(lambda: make_etag('subjects', subjects_store.version()), Subject.get_subject_order)
+
+    @app.route('/api/board')
+    def api_board():
+        # API端点，一次返回学科顺序、分组作业和标签（来自预计算视图，支持ETag条件请求）
+        etag, body = board_view.get()
+        if etag_matches(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/api/homework/changes')
+    def api_homework_changes():
+        # API端点，返回自since版本以来的增量变更，版本过旧时返回全量快照
+        version, entries = change_log.changes_since(request.args.get('since'))
+        if entries is None:
+            # 全量快照直接复用看板预计算视图（及其压缩结果）
+            etag, body = board_view.get()
+            response = Response(body, mimetype='application/json')
+            response.compression_key = etag
+            return response
+        
+        # 合并变更：同一作业只返回最终状态
+        added_ids = set()
+        touched_ids = []
+        labels_changed = subjects_changed = False
+        for entry in entries:
+            if entry['kind'] == 'labels':
+                labels_changed = True
+            elif entry['kind'] == 'subjects':
+                subjects_changed = True
+            if entry['action'] == 'added':
+                added_ids.update(entry['homework_ids'])
+            for homework_id in entry['homework_ids']:
+                if homework_id not in touched_ids:
+                    touched_ids.append(homework_id)
+        
+        added, updated, deleted = [], [], []
+        for homework_id in touched_ids:
+            homework = homework_repo.get(homework_id)
+            if homework is None:
+                # 本次窗口内新增后又删除的作业，客户端从未见过，无需下发
+                if homework_id not in added_ids:
+                    deleted.append(homework_id)
+            elif homework_id in added_ids:
+                added.append(homework)
+            else:
+                updated.append(homework)
+        
+        result = {"version": version, "full": False, "added": added, "updated": updated, "deleted": deleted}
+        if labels_changed:
+            result["labels"] = Label.load_labels()
+        if subjects_changed:
+            result["subjects"] = Subject.get_subject_order()
+        return jsonify(result)
+
+    @app.route('/api/homework/stream')
+    def api_homework_stream():
+        # SSE端点：数据写入后推送版本通知，客户端再通过/api/homework/changes拉取增量
+        if not stream_subscribers.acquire():
+            return jsonify({"error": "推送连接数已达上限，请使用轮询"}), 503, {'Retry-After': '60'}
+        
+        # 断线重连时浏览器会带上Last-Event-ID，从该版本继续
+        token = request.headers.get('Last-Event-ID') or request.args.get('since') or change_log.changes_since(None)[0]
+        
+        def generate():
+            nonlocal token
+            yield "retry: 5000\n\n"
+            while True:
+                version, entries = change_log.changes_since(token)
+                if entries is None or entries:
+                    payload = json_dumps({"version": version, "full": entries is None})
+                    yield f"id: {version}\nevent: change\ndata: {payload}\n\n"
+                    token = version
+                if not change_log.wait_for_change(token, SSE_HEARTBEAT_SECONDS):
+                    yield ": heartbeat\n\n"
+        
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # 在响应关闭时释放名额：HEAD请求或首个数据块前断开时生成器的finally不会执行，但close总会被调用
+        response.call_on_close(stream_subscribers.release)
+        return response
+
+    @app.route('/api/homework/due')
+    def api_homework_due():
+        # API端点，返回今天起within时间内到期的作业（如24h、3d、1w），可按学科筛选
+        within = request.args.get('within', '24h')
+        match = re.match(r'^(\d{1,9})([hdw])$', within)
+        if not match:
+            return jsonify({"error": "within格式应为数字加单位h/d/w，如24h"}), 400
+        hours = int(match.group(1)) * {'h': 1, 'd': 24, 'w': 24 * 7}[match.group(2)]
+        delta = timedelta(hours=min(hours, HOMEWORK_DUE_MAX_DAYS * 24))
+        
+        now = datetime.now()
+        start = now.strftime('%Y-%m-%d')
+        end = (now + delta).strftime('%Y-%m-%d')
+        subject = request.args.get('subject') or None
+        result = {"from": start, "to": end, "submissions": deadline_index.due_between(start, end, subject)}
+        if request.args.get('undated') in ('1', 'true'):
+            result["undated"] = deadline_index.undated(subject)
+        return jsonify(result)
+
+    @app.route('/api/homework/search')
+    def api_homework_search():
+        # API端点，按学科/内容/标签全文检索作业，支持分页（page为1~1000，per_page最大50）
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({"error": "请输入搜索内容"}), 400
+        try:
+            page = min(max(int(request.args.get('page', 1)), 1), 1000)
+            per_page = min(max(int(request.args.get('per_page', 20)), 1), 50)
+        except ValueError:
+            return jsonify({"error": "page和per_page必须是整数"}), 400
+        
+        total, hits = search_index.search(query, (page - 1) * per_page, per_page)
+        return jsonify({
+            "query": query,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "results": [dict(homework, score=score) for score, homework in hits]
+        })
+
+    @app.route('/api/homework/archive')
+    def api_homework_archive():
+        # API端点，只读返回某月（YYYY-MM）的归档作业；不带month时返回已有归档月份
+        month = request.args.get('month')
+        if not month:
+            return jsonify({"months": homework_archive.months()})
+        if not HomeworkArchive.MONTH_PATTERN.match(month):
+            return jsonify({"error": "month格式应为YYYY-MM"}), 400
+        
+        store = homework_archive.store(month)
+        return conditional_json_response(lambda: make_etag('archive', month, store.version()), lambda: {"month": month, "submissions": homework_archive.load_month(month)})
+
+    @app.route('/api/homework/cache_stats')
+    def api_homework_cache_stats():
+        # API端点，返回作业缓存的命中/未命中统计（仅管理员）
+        if not ip_policy.is_admin(get_client_ip()):
+            return jsonify({"error": "无权限"}), 403
+        return jsonify(homework_store.stats())
+
+    @app.route('/api/log_stats')
+    def api_log_stats():
+        # API端点，返回后台日志写入的队列与溢出统计（仅管理员）
+        if not ip_policy.is_admin(get_client_ip()):
+            return jsonify({"error": "无权限"}), 403
+        return jsonify(log_writer.stats())
+
+    def validate_fields(subject, content):
+        """校验作业的学科与内容，返回错误信息列表"""
+        errors = []
+        if not subject or not isinstance(subject, str):
+            errors.append("请选择学科")
+        if not isinstance(content, str) or len(content.strip()) < 5:
+            errors.append("内容至少需要5个字符")
+        return errors
+
+    def resolve_labels(label_ids):
+        """将标签ID解析为(标签名列表, 标签ID列表)，没有有效标签时使用“未知标签”"""
+        selected_labels = []
+        selected_label_ids = []
+        for label_id in label_ids:
+            try:
+                label_obj = Label.get_by_id(int(label_id))
+            except (TypeError, ValueError):
+                label_obj = None
+            if label_obj:
+                selected_labels.append(label_obj["name"])
+                selected_label_ids.append(label_obj["id"])
+        
+        if not selected_labels:
+            unknown_label = Label.get_by_name("未知标签")
+            if unknown_label:
+                selected_labels.append(unknown_label["name"])
+                selected_label_ids.append(unknown_label["id"])
+        return selected_labels, selected_label_ids
 
     @app.route('/homework/publish', methods=['GET', 'POST'])
     def homework_publish():
@@ -450,32 +2843,15 @@ class Homework:
             deadline = request.form.get('deadline')
             
             # 基本验证
-            errors = []
-            if not subject:
-                errors.append("请选择学科")
-            if not content or len(content.strip()) < 5:
-                errors.append("内容至少需要5个字符")
+            errors = Homework.validate_fields(subject, content)
             # 移除了必须填写截止日期的要求
             
             if errors:
                 for error in errors:
                     flash(error, 'error')
             else:
-                # 处理标签
-                selected_labels = []
-                selected_label_ids = []
-                for label_id in label_ids:
-                    label_obj = next((label for label in labels if label["id"] == int(label_id)), None)
-                    if label_obj:
-                        selected_labels.append(label_obj["name"])
-                        selected_label_ids.append(int(label_id))
-                
-                # 如果没有选择标签，则添加"未知标签"
-                if not selected_labels:
-                    unknown_label = next((label for label in labels if label["name"] == "未知标签"), None)
-                    if unknown_label:
-                        selected_labels.append(unknown_label["name"])
-                        selected_label_ids.append(unknown_label["id"])
+                # 处理标签（没有选择标签时使用"未知标签"）
+                selected_labels, selected_label_ids = Homework.resolve_labels(label_ids)
                 
                 # 如果未确认，则显示确认页面
                 if not confirm:
@@ -498,12 +2874,7 @@ class Homework:
                                          confirm_data=confirm_data)
                 
                 # 确认后执行添加操作
-                # 加载最新的数据
-                submissions = load_submissions()
-                
-                # 保存提交的数据
                 submission = {
-                    'id': len(submissions) + 1,
                     'subject': subject,
                     'content': content,
                     'labels': selected_labels,
@@ -511,8 +2882,8 @@ class Homework:
                     'deadline': deadline if deadline else '',
                     'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
-                submissions.append(submission)
-                save_submissions(submissions)
+                submission = homework_repo.insert(submission)
+                notify_homework_change('added', [submission['id']])
                 
                 # 清除session中的发布数据
                 '''
@@ -547,15 +2918,85 @@ class Homework:
                              labels=labels,
                              subjects=subjects)
 
+    @app.route('/api/homework/bulk_publish', methods=['POST'])
+    def homework_bulk_publish():
+        # API端点，批量布置作业：逐条校验，有效作业一次写入，返回每条的结果
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"success": False, "message": "请提供作业列表items"}), 400
+        if len(items) > HOMEWORK_BULK_LIMIT:
+            return jsonify({"success": False, "message": f"单次最多布置{HOMEWORK_BULK_LIMIT}条作业"}), 400
+        
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        results = []
+        records = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({"index": index, "success": False, "errors": ["格式错误"]})
+                continue
+            # 字段必须是字符串，否则会写入无法分组的数据（如列表作为学科）
+            invalid_fields = [field for field in ('subject', 'content', 'deadline')
+                              if item.get(field) is not None and not isinstance(item.get(field), str)]
+            if invalid_fields:
+                results.append({"index": index, "success": False, "errors": [f"{', '.join(invalid_fields)}必须是字符串"]})
+                continue
+            subject = item.get('subject')
+            content = item.get('content')
+            deadline = item.get('deadline') or ''
+            errors = Homework.validate_fields(subject, content)
+            if subject and Subject.get_by_name(subject) is None:
+                errors.append(f"学科“{subject}”不存在")
+            if deadline:
+                try:
+                    datetime.strptime(deadline, '%Y-%m-%d')
+                except (TypeError, ValueError):
+                    errors.append("截止日期格式应为YYYY-MM-DD")
+            if errors:
+                results.append({"index": index, "success": False, "errors": errors})
+                continue
+            
+            label_ids = item.get('label_ids') or []
+            selected_labels, selected_label_ids = Homework.resolve_labels(label_ids if isinstance(label_ids, list) else [label_ids])
+            records.append({
+                'subject': subject,
+                'content': content,
+                'labels': selected_labels,
+                'label_ids': selected_label_ids,
+                'deadline': deadline,
+                'timestamp': timestamp
+            })
+            results.append({"index": index, "success": True})
+        
+        # 所有有效作业一次写入
+        saved = homework_repo.insert_many(records) if records else []
+        if saved:
+            notify_homework_change('added', [record['id'] for record in saved])
+        
+        ip_address = get_client_ip()
+        saved_iter = iter(saved)
+        for result in results:
+            if not result["success"]:
+                continue
+            record = next(saved_iter)
+            result["id"] = record['id']
+            log_operation("添加作业", {
+                "subject": record['subject'],
+                "content": record['content'],
+                "labels": record['labels'],
+                "deadline": record['deadline'] if record['deadline'] else '无截止日期'
+            }, ip_address)
+        
+        return jsonify({"success": bool(saved), "created": len(saved), "results": results}), 200 if saved else 400
+
     @app.route('/homework/edit/<int:homework_id>', methods=['GET', 'POST'])
     def edit_homework(homework_id):
         # 加载数据
-        submissions = load_submissions()
         labels = Label.load_labels()
         subjects = Subject.load_subjects()
         
         # 查找要编辑的作业
-        homework = next((s for s in submissions if s['id'] == homework_id), None)
+        homework = homework_repo.get(homework_id)
         if not homework:
             flash('作业未找到！', 'error')
             return redirect(url_for('view_submissions'))
@@ -582,11 +3023,7 @@ class Homework:
             deadline = request.form.get('deadline')
             
             # 基本验证
-            errors = []
-            if not subject:
-                errors.append("请选择学科")
-            if not content or len(content.strip()) < 5:
-                errors.append("内容至少需要5个字符")
+            errors = Homework.validate_fields(subject, content)
             '''
             if not deadline:
                 errors.append("请选择截止日期")
@@ -596,21 +3033,8 @@ class Homework:
                 for error in errors:
                     flash(error, 'error')
             else:
-                # 处理标签
-                selected_labels = []
-                selected_label_ids = []
-                for label_id in label_ids:
-                    label_obj = next((label for label in labels if label["id"] == int(label_id)), None)
-                    if label_obj:
-                        selected_labels.append(label_obj["name"])
-                        selected_label_ids.append(int(label_id))
-                
-                # 如果没有选择标签，则添加"未知标签"
-                if not selected_labels:
-                    unknown_label = next((label for label in labels if label["name"] == "未知标签"), None)
-                    if unknown_label:
-                        selected_labels.append(unknown_label["name"])
-                        selected_label_ids.append(unknown_label["id"])
+                # 处理标签（没有选择标签时使用"未知标签"）
+                selected_labels, selected_label_ids = Homework.resolve_labels(label_ids)
                 
                 # 如果未确认，则显示确认页面
                 if not confirm:
@@ -645,7 +3069,8 @@ class Homework:
                 homework['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 
                 # 保存更新后的数据
-                save_submissions(submissions)
+                homework_repo.update(homework)
+                notify_homework_change('updated', [homework_id])
                 
                 # 清除session中的编辑数据，'
                 '''
@@ -696,11 +3121,8 @@ class Homework:
     
     @app.route('/homework/delete/<int:homework_id>', methods=['POST'])
     def delete_homework(homework_id):
-        # 加载数据
-        submissions = load_submissions()
-        
         # 查找要删除的作业
-        homework = next((s for s in submissions if s['id'] == homework_id), None)
+        homework = homework_repo.get(homework_id)
         if not homework:
             # 检查是否是 AJAX 请求
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -715,16 +3137,9 @@ class Homework:
         if not confirm:
             return render_template('homework_edit.html', homework=homework, labels=Label.load_labels(), now=datetime.now(), delete_confirm=True)
         
-        # 确认后执行删除操作
-        # 从列表中删除作业
-        submissions = [s for s in submissions if s['id'] != homework_id]
-        
-        # 重新编号ID以保持连续性
-        for i, submission in enumerate(submissions):
-            submission['id'] = i + 1
-        
-        # 保存更新后的数据
-        save_submissions(submissions)
+        # 确认后执行删除操作（仅标记该条作业，其余作业ID保持不变）
+        homework_repo.delete(homework_id)
+        notify_homework_change('deleted', [homework_id])
         
         # 记录日志
         log_operation("删除作业", {
@@ -742,13 +3157,80 @@ class Homework:
         flash('作业删除成功！', 'success')
         return redirect(url_for('view_submissions'))
 
+    @app.route('/api/homework/bulk_action', methods=['POST'])
+    def homework_bulk_action():
+        # API端点，批量操作作业：delete（按ID删除）、delete_expired（删除已过期）、move（移动到学科）、relabel（重设标签）
+        # 每种操作一次写入、一次变更通知
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': '请求体必须是JSON对象'}), 400
+        action = data.get('action')
+        if action not in ('delete', 'delete_expired', 'move', 'relabel'):
+            return jsonify({'success': False, 'message': '未知的批量操作'}), 400
+        
+        if action == 'delete_expired':
+            today = datetime.now().strftime('%Y-%m-%d')
+            targets = [h for h in homework_repo.all() if h.get('deadline') and h['deadline'] < today]
+        else:
+            # ids必须是整数（或数字字符串）列表；字符串会被逐字符拆开，不能直接迭代
+            raw_ids = data.get('ids')
+            if not isinstance(raw_ids, list) or not all(
+                    (isinstance(homework_id, int) and not isinstance(homework_id, bool))
+                    or (isinstance(homework_id, str) and homework_id.isdigit())
+                    for homework_id in raw_ids):
+                return jsonify({'success': False, 'message': '作业ID格式错误'}), 400
+            ids = {int(homework_id) for homework_id in raw_ids}
+            targets = [h for h in (homework_repo.get(homework_id) for homework_id in sorted(ids)) if h]
+        if not targets:
+            return jsonify({'success': False, 'message': '没有符合条件的作业'}), 404
+        
+        ip_address = get_client_ip()
+        if action in ('delete', 'delete_expired'):
+            affected = homework_repo.delete_many([h['id'] for h in targets])
+            if affected:
+                notify_homework_change('deleted', affected)
+            for homework in targets:
+                if homework['id'] in affected:
+                    log_operation("删除作业", {
+                        "id": homework['id'],
+                        "subject": homework['subject'],
+                        "content": homework['content'],
+                        "labels": homework['labels'],
+                        "deadline": homework['deadline']
+                    }, ip_address)
+            return jsonify({'success': True, 'message': f'已删除{len(affected)}条作业', 'affected': affected})
+        
+        if action == 'move':
+            subject = data.get('subject')
+            if not isinstance(subject, str) or Subject.get_by_name(subject) is None:
+                return jsonify({'success': False, 'message': '请选择有效的学科'}), 400
+            changes = {'subject': subject}
+        else:
+            label_ids = data.get('label_ids') or []
+            if not isinstance(label_ids, list):
+                return jsonify({'success': False, 'message': '标签ID格式错误'}), 400
+            selected_labels, selected_label_ids = Homework.resolve_labels(label_ids)
+            changes = {'labels': selected_labels, 'label_ids': selected_label_ids}
+        
+        records = [dict(homework, **changes) for homework in targets]
+        affected = homework_repo.update_many(records)
+        if affected:
+            notify_homework_change('updated', affected)
+        for record in records:
+            if record['id'] in affected:
+                log_operation("编辑作业", {
+                    "id": record['id'],
+                    "subject": record['subject'],
+                    "content": record['content'],
+                    "labels": record['labels'],
+                    "deadline": record['deadline'] if record['deadline'] else '无截止日期'
+                }, ip_address)
+        return jsonify({'success': True, 'message': f'已更新{len(affected)}条作业', 'affected': affected})
+
     @app.route('/homework/delete_confirm/<int:homework_id>')
     def delete_homework_confirm(homework_id):
-        # 加载数据
-        submissions = load_submissions()
-        
         # 查找要删除的作业
-        homework = next((s for s in submissions if s['id'] == homework_id), None)
+        homework = homework_repo.get(homework_id)
         if not homework:
             flash('作业未找到！', 'error')
             return redirect(url_for('view_submissions'))
@@ -758,30 +3240,45 @@ class Homework:
 @app.route('/submissions')
 def view_submissions():
     # 每次访问时都重新加载数据，确保获取最新数据
-    submissions = load_submissions()
+    submissions = homework_repo.all()
     labels = Label.load_labels()
-    return render_template('submissions.html', submissions=submissions, labels=labels)
+    return render_template('submissions.html', submissions=submissions, labels=labels, subjects=Subject.get_subject_order())
 
 class Label:
+    def build_label_table(labels):
+        """构建标签查找表：补全默认颜色后的列表、id→标签、名称→标签"""
+        table = {"labels": [], "by_id": {}, "by_name": {}}
+        for label in labels or []:
+            label = dict(label)
+            # 确保所有标签都有颜色属性
+            if 'color' not in label:
+                if label['name'] == '未知标签':
+                    label['color'] = '#808080'  # 灰色
+                else:
+                    label['color'] = '#3498db'  # 默认蓝色
+            table["labels"].append(label)
+            table["by_id"][label['id']] = label
+            table["by_name"].setdefault(label['name'], label)
+        return table
+
+    def label_table():
+        """返回当前标签文件版本对应的查找表（文件不存在时先写入默认标签）"""
+        if labels_store.load() is None:
+            save_labels(default_labels)
+        return label_lookup.get()
+
     def load_labels():
-        """从JSON文件加载标签数据"""
-        global default_labels, LABELS_FILE, save_labels
-        if os.path.exists(LABELS_FILE):
-            with open(LABELS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    labels = json.load(f)
-                    # 确保所有标签都有颜色属性
-                    for label in labels:
-                        if 'color' not in label:
-                            if label['name'] == '未知标签':
-                                label['color'] = '#808080'  # 灰色
-                            else:
-                                label['color'] = '#3498db'  # 默认蓝色
-                    return labels
-                except json.JSONDecodeError:
-                    pass
-        save_labels(default_labels)
-        return default_labels
+        """从JSON文件加载标签数据（返回副本）"""
+        return [dict(label) for label in Label.label_table()["labels"]]
+
+    def get_by_id(label_id):
+        """按ID查找标签，不存在时返回None"""
+        return Label.label_table()["by_id"].get(label_id)
+
+    def get_by_name(name):
+        """按名称查找标签，不存在时返回None"""
+        return Label.label_table()["by_name"].get(name)
+
     @app.route('/label/edit', methods=['GET', 'POST'])
     def edit_labels():
         # 每次访问时都重新加载标签，确保获取最新数据
@@ -814,7 +3311,7 @@ class Label:
                 new_color = request.form.get('new_color')
                 
                 # 查找"未知标签"，防止被修改
-                unknown_label = next((label for label in labels if label["name"] == "未知标签"), None)
+                unknown_label = Label.get_by_name("未知标签")
                 
                 if label_id and new_name:
                     # 确保不修改"未知标签"
@@ -836,7 +3333,7 @@ class Label:
                 label_id = int(request.form.get('label_id'))
                 
                 # 查找"未知标签"，防止被删除
-                unknown_label = next((label for label in labels if label["name"] == "未知标签"), None)
+                unknown_label = Label.get_by_name("未知标签")
                 
                 # 确保不删除"未知标签"
                 if unknown_label and unknown_label["id"] == label_id:
@@ -856,15 +3353,33 @@ class Label:
 
 
 class Subject:
+    @staticmethod
+    def build_subject_table(subjects):
+        """构建科目查找表：名称→科目与按order排序的名称列表"""
+        subjects = subjects or []
+        return {
+            "by_name": {subject["name"]: subject for subject in subjects},
+            "order": [subject["name"] for subject in sorted(subjects, key=lambda x: x.get('order', 999))]
+        }
+
+    @staticmethod
+    def subject_table():
+        """返回当前科目文件版本对应的查找表（文件不存在时先写入默认科目）"""
+        if subjects_store.load() is None:
+            Subject.load_subjects()
+        return subject_lookup.get()
+
+    @staticmethod
+    def get_by_name(name):
+        """按名称查找科目，不存在时返回None（调用方不得原地修改）"""
+        return Subject.subject_table()["by_name"].get(name)
+
     @staticmethod
     def load_subjects():
         """从JSON文件加载科目数据"""
-        if os.path.exists(SUBJECTS_FILE):
-            with open(SUBJECTS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    pass
+        subjects = subjects_store.load()
+        if subjects is not None:
+            return copy.deepcopy(subjects)
         
         # 默认科目列表
         default_subjects = [
@@ -883,37 +3398,36 @@ class Subject:
         Subject.save_subjects(default_subjects)
         return default_subjects
     
+    @staticmethod
+    def get_subject_order():
+        """返回按order字段排序的科目名称列表"""
+        return list(Subject.subject_table()["order"])
+
     @staticmethod
     def save_subjects(subjects):
         """将科目数据保存到JSON文件"""
-        with open(SUBJECTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(subjects, f, ensure_ascii=False, indent=2)
+        subjects_store.save(copy.deepcopy(subjects))
+        change_log.record('subjects')
     
     @staticmethod
     def get_common_words_by_subject(subject_name):
         """根据科目名称获取常用词"""
-        subjects = Subject.load_subjects()
-        subject = next((s for s in subjects if s["name"] == subject_name), None)
+        subject = Subject.get_by_name(subject_name)
         if subject:
-            return subject.get("common_words", [])
+            return list(subject.get("common_words", []))
         return []
     
     @staticmethod
     def get_all_common_words_list():
         """获取所有通用常用词列表（用于模板渲染）"""
         # 检查是否存在专门的通用词文件
-        GLOBAL_WORDS_FILE = os.path.join(DATA_DIR, 'global_words.json')
-        if os.path.exists(GLOBAL_WORDS_FILE):
-            with open(GLOBAL_WORDS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    pass
+        global_words = global_words_store.load()
+        if global_words is not None:
+            return list(global_words)
         
         # 如果没有单独的通用词文件，则回退到原来的逻辑
-        subjects = Subject.load_subjects()
         all_words = []
-        for subject in subjects:
+        for subject in Subject.subject_table()["by_name"].values():
             all_words.extend(subject.get("common_words", []))
         # 只返回通用词（出现在多个科目中的词）
         word_count = {}
@@ -928,12 +3442,28 @@ class Subject:
         words = Subject.get_all_common_words_list()
         return jsonify(words)
 
+    @staticmethod
+    @app.route('/api/words/suggest', methods=['GET'])
+    def suggest_words():
+        """按前缀联想常用词（通用词加所选科目的常用词），按在已布置作业中的使用次数排序"""
+        subject = request.args.get('subject') or None
+        prefix = request.args.get('prefix', '')
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        except ValueError:
+            return jsonify({"error": "limit必须是整数"}), 400
+        
+        return conditional_json_response(
+            lambda: make_etag('words', *word_suggest_index.data_version(), subject or '', prefix, str(limit)), lambda: {
+            "subject": subject,
+            "prefix": prefix,
+            "words": [word for word, _ in word_suggest_index.suggest(subject, prefix, limit)]
+        })
+
     @staticmethod
     def save_global_common_words(words):
         """保存全局常用词到独立文件"""
-        GLOBAL_WORDS_FILE = os.path.join(DATA_DIR, 'global_words.json')
-        with open(GLOBAL_WORDS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(words, f, ensure_ascii=False, indent=2)
+        global_words_store.save(list(words))
 
     @app.route('/subjects', methods=['GET', 'POST'])
     def manage_subjects():
@@ -1044,87 +3574,16 @@ class Fun:
             student_id = request.form.get('student_id', '').strip()
             password = request.form.get('password', '').strip()
             
-            print(f"调试信息 - 输入姓名: '{name}', 学号: '{student_id}', 密码: '{password}'")
-            print(f"调试信息 - students_data类型: {type(students_data)}")
-            print(f"调试信息 - students_data内容: {students_data}")
-            
-            # 确保students_data是字典
-            if not isinstance(students_data, dict):
-                print(f"错误: students_data不是字典，而是{type(students_data)}")
-                flash('系统配置错误，请联系管理员', 'error')
-                return render_template('fun_auth.html', name=name, student_id=student_id)
-            
-            # 验证用户信息
+            # 验证用户信息（姓名+学号索引查找）
             authenticated = False
-            matched_name = None
-            matched_id = None
-            
-            # 方法1: 直接键值匹配
-            if name and name in students_data:
-                expected_id = str(students_data[name]).strip()
-                input_id = student_id.strip()
-                print(f"调试信息 - 直接匹配: 期望学号='{expected_id}', 输入学号='{input_id}'")
-                
-                if input_id == expected_id:
-                    # 验证密码
-                    if student_id in password_data:
-                        # 使用存储的密码验证
-                        if password_data[student_id] == password:
-                            authenticated = True
-                            matched_name = name
-                            matched_id = expected_id
-                            print(f"调试信息 - 密码验证成功（自定义密码）")
-                        else:
-                            flash('密码不正确！', 'error')
-                            return render_template('fun_auth.html', name=name, student_id=student_id)
-                    else:
-                        # 使用默认密码验证
-                        if password == get_default_password():
-                            authenticated = True
-                            matched_name = name
-                            matched_id = expected_id
-                            print(f"调试信息 - 密码验证成功（默认密码）")
-                        else:
-                            flash('密码不正确！', 'error')
-                            return render_template('fun_auth.html', name=name, student_id=student_id)
-            
-            # 方法2: 如果直接匹配失败，尝试遍历所有项进行模糊匹配
-            if not authenticated and students_data:
-                print(f"调试信息 - 开始模糊匹配")
-                for stored_name, stored_id in students_data.items():
-                    stored_name_clean = str(stored_name).strip()
-                    stored_id_clean = str(stored_id).strip()
-                    input_name_clean = name.strip()
-                    input_id_clean = student_id.strip()
-                    
-                    print(f"调试信息 - 比较: '{input_name_clean}' vs '{stored_name_clean}', '{input_id_clean}' vs '{stored_id_clean}'")
-                    
-                    # 比较去除空格后的值
-                    if (input_name_clean == stored_name_clean and 
-                        input_id_clean == stored_id_clean):
-                        # 验证密码
-                        if stored_id_clean in password_data:
-                            # 使用存储的密码验证
-                            if password_data[stored_id_clean] == password:
-                                authenticated = True
-                                matched_name = stored_name_clean
-                                matched_id = stored_id_clean
-                                print(f"调试信息 - 模糊匹配成功: {matched_name}")
-                                break
-                            else:
-                                flash('密码不正确！', 'error')
-                                return render_template('fun_auth.html', name=name, student_id=student_id)
-                        else:
-                            # 使用默认密码验证
-                            if password == get_default_password():
-                                authenticated = True
-                                matched_name = stored_name_clean
-                                matched_id = stored_id_clean
-                                print(f"调试信息 - 模糊匹配成功: {matched_name}")
-                                break
-                            else:
-                                flash('密码不正确！', 'error')
-                                return render_template('fun_auth.html', name=name, student_id=student_id)
+            matched = student_directory.find(name, student_id)
+            if matched:
+                matched_name, matched_id = matched
+                # 验证密码（未设置自定义密码时使用默认密码）
+                authenticated = credential_store.verify(matched_id, password)
+                if not authenticated:
+                    flash('密码不正确！', 'error')
+                    return render_template('fun_auth.html', name=name, student_id=student_id)
             
             if authenticated:
                 # 验证成功
@@ -1143,7 +3602,6 @@ class Fun:
                 return response
             else:
                 # 验证失败
-                print(f"调试信息 - 验证失败")
                 flash('姓名、学号或密码不正确，请重试！', 'error')
                 # 保留表单数据以便重新输入
                 return render_template('fun_auth.html', name=name, student_id=student_id)
@@ -1168,17 +3626,10 @@ class Fun:
                 new_password = request.form.get('new_password', '').strip()
                 confirm_password = request.form.get('confirm_password', '').strip()
                 
-                # 验证当前密码
-                if student_id in password_data:
-                    # 使用自定义密码验证
-                    if password_data[student_id] != current_password:
-                        flash('当前密码不正确！', 'error')
-                        return render_template('fun_password.html', name=name, student_id=student_id)
-                else:
-                    # 使用默认密码验证
-                    if current_password != get_default_password():
-                        flash('当前密码不正确！', 'error')
-                        return render_template('fun_password.html', name=name, student_id=student_id)
+                # 验证当前密码（未设置自定义密码时使用默认密码）
+                if not credential_store.verify(student_id, current_password):
+                    flash('当前密码不正确！', 'error')
+                    return render_template('fun_password.html', name=name, student_id=student_id)
                 
                 # 验证新密码
                 is_valid, message = validate_password(new_password)
@@ -1192,17 +3643,14 @@ class Fun:
                     return render_template('fun_password.html', name=name, student_id=student_id)
                 
                 # 保存新密码
-                password_data[student_id] = new_password
-                save_password_data()
+                credential_store.set_password(student_id, new_password)
                 
                 flash('密码设置成功！', 'success')
                 return redirect(url_for('fun_index'))
             
             elif action == 'reset_password':
                 # 重置密码（删除自定义密码，使用默认密码）
-                if student_id in password_data:
-                    del password_data[student_id]
-                    save_password_data()
+                if credential_store.reset_password(student_id):
                     flash('密码已重置为默认密码！', 'success')
                 else:
                     flash('您当前使用的是默认密码，无需重置！', 'info')
@@ -1234,12 +3682,10 @@ class Fun:
             anonymous = request.form.get('anonymous') == 'on'
             
             # 检查提交频率限制
-            limit_check = check_submit_limit(name, student_id)
+            limit_message = check_submit_limit(name, student_id)
             
-            if limit_check['within_30s']:
-                flash('提交过于频繁，请间隔至少30秒再提交！', 'error')
-            elif limit_check['within_24h']:
-                flash('您今天的提交次数已达上限（15次）！', 'error')
+            if limit_message:
+                flash(limit_message, 'error')
             # 验证内容
             elif not content or len(content.strip()) == 0:
                 flash('内容不能为空！', 'error')
@@ -1291,52 +3737,36 @@ class Fun:
         if not name or not student_id:
             return redirect(url_for('fun_auth'))
         
-        # 获取要删除的条目信息
+        # 获取要删除的条目信息（优先按id定位，兼容旧页面提交的时间戳+内容）
+        input_id = request.form.get('id', type=int)
         timestamp = request.form.get('timestamp')
         content = request.form.get('content')
         
-        if not timestamp or not content:
+        if input_id is None and (not timestamp or not content):
             flash('无效的请求', 'error')
             return redirect(url_for('fun_view'))
         
-        # 加载所有输入
-        inputs = load_inputs()
+        if input_id is not None:
+            entry = input_store.get(input_id)
+            candidates = [entry] if entry else []
+        else:
+            candidates = [e for e in load_inputs() if e['timestamp'] == timestamp and e['content'] == content]
         
         # 获取客户端IP地址
         client_ip = get_client_ip()
         
-        # 查找并删除匹配的条目
-        original_length = len(inputs)
-        
-        # 检查权限：是否是发布者或管理员IP
-        new_inputs = []
+        # 检查权限：发布者或管理员才能删除（追加墓碑，不重写文件）
         deleted = False
-        for input_entry in inputs:
-            # 检查是否匹配要删除的条目
-            if (input_entry['timestamp'] == timestamp and 
-                input_entry['content'] == content):
-                # 检查权限：发布者或管理员
-                if (input_entry['student_id'] == student_id or 
-                    client_ip == '127.0.0.1' or 
-                    client_ip in data_ip.get('admin_ips', [])):
-                    deleted = True
-                    # 不添加到new_inputs中，实现删除
-                else:
-                    # 没有权限，保留条目
-                    new_inputs.append(input_entry)
-            else:
-                # 不是要删除的条目，保留
-                new_inputs.append(input_entry)
+        for input_entry in candidates:
+            if input_entry['student_id'] == student_id or ip_policy.is_admin(client_ip):
+                deleted = input_store.delete(input_entry['id']) or deleted
+                timestamp, content = input_entry['timestamp'], input_entry['content']
         
         # 如果没有删除任何条目，说明权限不足
         if not deleted:
             flash('删除失败，可能是权限不足', 'error')
             return redirect(url_for('fun_view'))
         
-        # 保存更新后的数据
-        with open(INPUT_LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(new_inputs, f, ensure_ascii=False, indent=2)
-        
         # 记录删除操作日志
         log_operation("删除提交内容", {
             "timestamp": timestamp,
@@ -1346,15 +3776,93 @@ class Fun:
         flash('删除成功', 'success')
         return redirect(url_for('fun_view'))
     
+    @app.route('/902504/admin/logs')
+    def admin_query_logs():
+        """管理员查询操作/登录日志，以NDJSON流式返回"""
+        if not ip_policy.is_admin(get_client_ip()):
+            return jsonify({"error": "无权限"}), 403
+        
+        log_files = {'operation': LOG_FILE, 'login': LOGIN_LOG_FILE}
+        log_name = request.args.get('log', 'operation')
+        if log_name not in log_files:
+            return jsonify({"error": "log只能是operation或login"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 1000)), 1), 10000)
+        except ValueError:
+            return jsonify({"error": "limit必须是整数"}), 400
+        
+        # 先让后台写线程写完已提交的日志，保证查询到最新记录
+        log_writer.flush()
+        key = request.args.get('operation') if log_name == 'operation' else request.args.get('name')
+        entries = query_log(
+            log_files[log_name],
+            key=key or None,
+            ip=request.args.get('ip') or None,
+            user=request.args.get('user') or None,
+            since=request.args.get('since') or None,
+            until=request.args.get('until') or None,
+            contains=request.args.get('contains') or None,
+            include_rotated=request.args.get('rotated') in ('1', 'true')
+        )
+        
+        def generate():
+            for count, entry in enumerate(entries, 1):
+                yield json_dumps(entry) + '\n'
+                if count >= limit:
+                    break
+        
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    @app.route('/902504/admin/ip_stats')
+    def admin_ip_stats():
+        """管理员查看IP名单各规则的命中次数"""
+        if not ip_policy.is_admin(get_client_ip()):
+            return jsonify({"error": "无权限"}), 403
+        return jsonify(ip_policy.stats())
+
     @app.route('/902504/debug/students')
     def debug_students():
-        """调试页面，显示学生数据"""
+        """调试页面，显示学生名单概况（仅管理员）"""
+        if not ip_policy.is_admin(get_client_ip()):
+            return jsonify({"error": "无权限"}), 403
         return jsonify({
-            "students_data": students_data,
-            "data_type": type(students_data).__name__,
-            "is_dict": isinstance(students_data, dict),
-            "keys": list(students_data.keys()) if isinstance(students_data, dict) else "N/A"
+            "count": student_directory.count(),
+            "index_builds": student_directory.table.builds,
+            "cache": students_store.stats(),
+            "keys": list(student_directory.all().keys())
         })
+
+    @app.route('/902504/admin/students/import', methods=['POST'])
+    def import_students():
+        """批量导入学生名单（CSV/XLSX，mode=merge合并 或 replace替换）"""
+        ip_address = get_client_ip()
+        if not ip_policy.is_admin(ip_address):
+            return jsonify({"error": "无权限"}), 403
+        file = request.files.get('file')
+        if file is None or not file.filename:
+            return jsonify({"error": "请上传名单文件"}), 400
+        mode = request.form.get('mode', 'merge')
+        if mode not in ('merge', 'replace'):
+            return jsonify({"error": "mode只能是merge或replace"}), 400
+        try:
+            records, errors = StudentDirectory.parse_rows(StudentDirectory.iter_rows(file))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"名单文件解析失败: {e}"}), 400
+        if not records:
+            return jsonify({"error": "名单中没有有效记录", "errors": errors[:50]}), 400
+        result = student_directory.import_records(records, replace=(mode == 'replace'))
+        log_operation("导入学生名单", {
+            "filename": file.filename,
+            "mode": mode,
+            "count": len(records),
+            "added": result['added'],
+            "updated": result['updated'],
+            "skipped": len(errors)
+        }, ip_address)
+        result.update({"success": True, "mode": mode, "skipped": len(errors), "errors": errors[:50]})
+        return jsonify(result)
     
 class AI:
     # 保存对话历史的文件路径
@@ -1396,7 +3904,7 @@ class AI:
         if os.path.exists(AI.QA_PROMPT_FILE):
             with open(AI.QA_PROMPT_FILE, 'r', encoding='utf-8') as f:
                 try:
-                    return json.load(f)
+                    return json_loads(f.read())
                 except json.JSONDecodeError:
                     return []
         return []
@@ -1405,7 +3913,7 @@ class AI:
     def save_qa_prompt(qa_list):
         """保存预设问答"""
         with open(AI.QA_PROMPT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(qa_list, f, ensure_ascii=False, indent=2)
+            f.write(json_dumps(qa_list, pretty=JSON_PRETTY))
     
     @staticmethod
     def load_chat_history(user_identifier, max_history=100, is_public=False):
@@ -1415,9 +3923,9 @@ class AI:
             with open(history_file, 'r', encoding='utf-8') as f:
                 try:
                     if is_public:
-                        return json.load(f)[-max_history:]  # 公共聊天直接返回最新消息
+                        return json_loads(f.read())[-max_history:]  # 公共聊天直接返回最新消息
                     else:
-                        all_history = json.load(f)
+                        all_history = json_loads(f.read())
                         return all_history.get(user_identifier, [])[-max_history:]
                 except json.JSONDecodeError:
                     return []
@@ -1433,9 +3941,9 @@ class AI:
             with open(history_file, 'r', encoding='utf-8') as f:
                 try:
                     if is_public:
-                        all_history = json.load(f)
+                        all_history = json_loads(f.read())
                     else:
-                        all_history = json.load(f)
+                        all_history = json_loads(f.read())
                 except json.JSONDecodeError:
                     all_history = [] if is_public else {}
         else:
@@ -1473,7 +3981,7 @@ class AI:
         
         # 保存回文件
         with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(all_history, f, ensure_ascii=False, indent=2)
+            f.write(json_dumps(all_history, pretty=JSON_PRETTY))
     
     @staticmethod
     def clear_chat_history(user_identifier, is_public=False):
@@ -1485,15 +3993,15 @@ class AI:
                 try:
                     if is_public:
                         # 公共聊天只能清空自己的消息
-                        all_history = json.load(f)
+                        all_history = json_loads(f.read())
                         all_history = [msg for msg in all_history if msg.get('user_identifier') != user_identifier]
                     else:
-                        all_history = json.load(f)
+                        all_history = json_loads(f.read())
                         if user_identifier in all_history:
                             all_history[user_identifier] = []
                     
                     with open(history_file, 'w', encoding='utf-8') as fw:
-                        json.dump(all_history, fw, ensure_ascii=False, indent=2)
+                        fw.write(json_dumps(all_history, pretty=JSON_PRETTY))
                     return True
                 except json.JSONDecodeError:
                     return False
@@ -1506,11 +4014,11 @@ class AI:
             try:
                 # 记录清空前的历史内容（用于日志）
                 with open(AI.PUBLIC_CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                    old_history = json.load(f)
+                    old_history = json_loads(f.read())
                 
                 # 清空公共聊天历史文件
                 with open(AI.PUBLIC_CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-                    json.dump([], f, ensure_ascii=False, indent=2)
+                    f.write(json_dumps([], pretty=JSON_PRETTY))
                 
                 return True, old_history
             except json.JSONDecodeError:
@@ -1518,52 +4026,24 @@ class AI:
         return False, []
 
     @staticmethod
-    def check_private_chat_limit(user_identifier):
-        """检查私人聊天发送频率限制（每分钟最多3条）"""
-        private_history = AI.load_chat_history(user_identifier, max_history=50, is_public=False)
-        
-        # 获取当前时间和1分钟前的时间
-        now = datetime.now()
-        past_1_minute = now - timedelta(minutes=1)
-        
-        # 统计用户1分钟内的消息数量
-        user_messages_1min = []
-        
-        for message in private_history:
-            if message.get('role') == 'user':
-                try:
-                    entry_time = datetime.strptime(message['timestamp'], "%Y-%m-%d %H:%M:%S")
-                    if entry_time >= past_1_minute:
-                        user_messages_1min.append(message)
-                except ValueError:
-                    continue
-        
-        return len(user_messages_1min) >= 3  # 1分钟内是否已有3条消息
+    def check_chat_quota(user_identifier, is_public, calls_ai):
+        """发送前检查配额（只访问内存/配额库，不读取聊天历史），超出时返回提示信息，否则返回None"""
+        # 先检查不扣除的当日token预算：调用AI的消息需要预算仍有剩余
+        if calls_ai and ai_quota_store.available('ai_tokens', user_identifier, AI_DAILY_TOKEN_BUDGET, 86400) <= 0:
+            return '今日AI使用额度已用完，请明天再试！'
+        # 最后才取令牌（此后请求一定会继续执行，被拒绝的消息不消耗限速配额）
+        # 私人对话每条消息、公共聊天的非@ai消息按令牌桶限速
+        quota = AI_QUOTAS['private'] if not is_public else (None if calls_ai else AI_QUOTAS['public'])
+        if quota and not ai_quota_store.consume('chat_' + ('public' if is_public else 'private'), user_identifier,
+                                                quota['capacity'], quota['period']):
+            return quota['message']
+        return None
 
     @staticmethod
-    def check_public_chat_limit(user_identifier):
-        """检查公共聊天发送频率限制（非AI消息每2分钟最多1条）"""
-        public_history = AI.load_chat_history(user_identifier, max_history=300, is_public=True)
-        
-        # 获取当前时间和2分钟前的时间
-        now = datetime.now()
-        past_2_minutes = now - timedelta(minutes=2)
-        
-        # 统计用户2分钟内的非AI消息数量
-        user_messages_2min = []
-        
-        for message in public_history:
-            if (message.get('user_identifier') == user_identifier and 
-                message.get('role') == 'user' and 
-                not message.get('content', '').strip().startswith('@ai')):
-                try:
-                    entry_time = datetime.strptime(message['timestamp'], "%Y-%m-%d %H:%M:%S")
-                    if entry_time >= past_2_minutes:
-                        user_messages_2min.append(message)
-                except ValueError:
-                    continue
-        
-        return len(user_messages_2min) >= 1  # 2分钟内是否已有非AI消息
+    def charge_ai_tokens(user_identifier, messages, response):
+        """按请求与回复的字符数近似扣除token预算"""
+        used = sum(len(message['content']) for message in messages) + len(response or '')
+        ai_quota_store.consume('ai_tokens', user_identifier, AI_DAILY_TOKEN_BUDGET, 86400, amount=used, allow_debt=True)
 
     @staticmethod
     def openai_stream(model="deepseek-v3.2-exp", messages=[]):
@@ -1653,21 +4133,19 @@ class AI:
                     flash('消息不能为空！', 'error')
                     return redirect(url_for('ai_chat', type=chat_type))
                 
+                # 修复：私人对话直接调用AI，不需要@ai前缀
+                calls_ai = not is_public or user_message.startswith('@ai')
+                
+                # 频率与额度检查在保存消息之前进行
+                quota_message = AI.check_chat_quota(user_identifier, is_public, calls_ai)
+                if quota_message:
+                    flash(quota_message, 'error')
+                    return redirect(url_for('ai_chat', type=chat_type))
+                
                 # 保存用户消息
                 AI.save_chat_message(user_identifier, 'user', user_message, is_public=is_public, name=name)
                 
-                # 修复：私人对话直接调用AI，不需要@ai前缀
-                if not is_public or user_message.startswith('@ai'):
-                    # 私人聊天频率限制检查
-                    if not is_public and AI.check_private_chat_limit(user_identifier):
-                        flash('私人对话中，每分钟最多只能发送3条消息！', 'error')
-                        return redirect(url_for('ai_chat', type=chat_type))
-                    
-                    # 公共聊天频率限制检查（仅对非@ai消息）
-                    if is_public and not user_message.startswith('@ai') and AI.check_public_chat_limit(user_identifier):
-                        flash('公共聊天中，非AI消息每2分钟只能发送一条！', 'error')
-                        return redirect(url_for('ai_chat', type=chat_type))
-                    
+                if calls_ai:
                     # 准备对话历史
                     chat_history = AI.load_chat_history(user_identifier, max_history=20, is_public=is_public)
                     system_prompt = AI.load_system_prompt(is_public=is_public)
@@ -1711,11 +4189,12 @@ class AI:
                             full_response = ""
                             for chunk in AI.openai_stream(messages=messages):
                                 full_response += chunk
-                                yield f"data: {json.dumps({'content': chunk})}\n\n"
+                                yield f"data: {json_dumps({'content': chunk})}\n\n"
                             
                             # 保存AI回复
                             AI.save_chat_message(user_identifier, 'assistant', full_response, 
                                             is_public=is_public, name="AI助手")
+                            AI.charge_ai_tokens(user_identifier, messages, full_response)
                             yield "data: [DONE]\n\n"
                         
                         return Response(generate(), mimetype='text/plain')
@@ -1725,6 +4204,7 @@ class AI:
                         ai_response = AI.openai(messages=messages)
                         AI.save_chat_message(user_identifier, 'assistant', ai_response, 
                                         is_public=is_public, name="AI助手")
+                        AI.charge_ai_tokens(user_identifier, messages, ai_response)
                     except Exception as e:
                         flash(f'AI服务暂时不可用: {str(e)}', 'error')
                 else:
@@ -1927,7 +4407,7 @@ class ClassroomGame:
         if os.path.exists(ClassroomGame.GAME_STATE_FILE):
             with open(ClassroomGame.GAME_STATE_FILE, 'r', encoding='utf-8') as f:
                 try:
-                    return json.load(f)
+                    return json_loads(f.read())
                 except json.JSONDecodeError:
                     pass
         
@@ -1947,7 +4427,7 @@ class ClassroomGame:
     def save_game_state(state):
         """保存游戏状态"""
         with open(ClassroomGame.GAME_STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.write(json_dumps(state, pretty=JSON_PRETTY))
     
     @staticmethod
     def init_game():
@@ -2303,7 +4783,7 @@ class CampusLegendGame:
         if os.path.exists(CampusLegendGame.GAME_STATE_FILE):
             with open(CampusLegendGame.GAME_STATE_FILE, 'r', encoding='utf-8') as f:
                 try:
-                    return json.load(f)
+                    return json_loads(f.read())
                 except json.JSONDecodeError:
                     pass
         
@@ -2324,7 +4804,7 @@ class CampusLegendGame:
     def save_game_state(state):
         """保存游戏状态"""
         with open(CampusLegendGame.GAME_STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.write(json_dumps(state, pretty=JSON_PRETTY))
     
     @staticmethod
     def init_game():
@@ -2692,11 +5172,24 @@ class CampusLegendGame:
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
 
+label_lookup = LookupTable(labels_store, Label.build_label_table)
+subject_lookup = LookupTable(subjects_store, Subject.build_subject_table)
+
 homework = Homework()
 label = Label()
 subject = Subject()
 fun = Fun()
 classroom_game = ClassroomGame()
 campus_legend_game = CampusLegendGame()
+if ARCHIVE_WORKER:
+    homework_archive.start(ARCHIVE_INTERVAL_SECONDS)
 if __name__ == '__main__':
+    # python app.py import-json：将submissions.json一次性导入SQLite
+    if len(sys.argv) > 1 and sys.argv[1] == 'import-json':
+        count = SqliteHomeworkRepository(HOMEWORK_DB_FILE).import_from_json()
+        print(f"已导入{count}条作业到{HOMEWORK_DB_FILE}")
+        sys.exit(0)
+    # debug模式下重载器的监视进程也会执行到这里，只在实际处理请求的子进程中启动归档
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        homework_archive.start(ARCHIVE_INTERVAL_SECONDS)
     app.run(host='0.0.0.0',debug=True,port=2025)
\ No newline at end of file
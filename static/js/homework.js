@@ -147,37 +147,121 @@ function adjustFontSize(change) {
     document.body.style.fontSize = currentSize + 'px';
 }
 
-// 开始自动刷新
+// 服务器推送（SSE）连接
+let homeworkStream = null;
+let streamUnavailable = false; // 推送不可用时回退到轮询
+
+// 开始自动刷新：优先使用服务器推送，不支持时按间隔轮询
 function startAutoRefresh() {
     fetchHomeworkAndLabels();
+    if (window.EventSource && !streamUnavailable) {
+        openHomeworkStream();
+        return;
+    }
     intervalId = setInterval(fetchHomeworkAndLabels, refreshInterval * 1000);
 }
 
-// 获取作业和标签数据
-function fetchHomeworkAndLabels() {
-    // 获取学科排序配置
-    const subjectsPromise = fetch('/api/subjects')
+// 打开作业推送连接，收到变更通知后拉取增量
+function openHomeworkStream() {
+    if (homeworkStream) return;
+    const url = '/api/homework/stream' + (boardVersion ? '?since=' + encodeURIComponent(boardVersion) : '');
+    homeworkStream = new EventSource(url);
+    homeworkStream.addEventListener('change', function() {
+        fetchHomeworkAndLabels();
+    });
+    homeworkStream.onerror = function() {
+        // 连接被拒绝（如订阅数已满）时浏览器不会自动重连，改用轮询
+        if (homeworkStream.readyState === EventSource.CLOSED) {
+            homeworkStream = null;
+            streamUnavailable = true;
+            if (intervalId) clearInterval(intervalId);
+            intervalId = setInterval(fetchHomeworkAndLabels, refreshInterval * 1000);
+        }
+    };
+}
+
+// 条件请求缓存：url -> {etag, data}
+const conditionalCache = {};
+
+// 带If-None-Match的请求，304时复用上次的数据
+function fetchWithETag(url) {
+    const cached = conditionalCache[url];
+    const headers = {};
+    if (cached && cached.etag) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    // 使用no-store，由脚本自行处理304，避免浏览器缓存干扰
+    return fetch(url, { headers: headers, cache: 'no-store' })
         .then(response => {
-            if (response.ok) return response.json();
-            throw new Error('Subjects file not found');
-        })
-        .catch(() => null);
+            if (response.status === 304 && cached) {
+                return cached.data;
+            }
+            if (!response.ok) {
+                throw new Error('Request failed: ' + url);
+            }
+            return response.json().then(data => {
+                conditionalCache[url] = { etag: response.headers.get('ETag'), data: data };
+                return data;
+            });
+        });
+}
 
-    // 获取作业数据
-    const homeworkPromise = fetch('/api/homework')
-        .then(response => response.json());
+// 看板增量同步状态
+let boardVersion = null;          // 最近一次同步到的服务器版本
+const homeworkById = new Map();   // 作业ID -> 作业
+let boardSubjectsOrder = null;    // 学科排序
 
-    // 并行处理两个请求的结果
-    Promise.all([subjectsPromise, homeworkPromise])
-        .then(([subjectsOrder, data]) => {
-            globalLabels = data.labels || [];
-            updateHomeworkContainer(data.submissions, globalLabels, subjectsOrder);
+// 获取作业和标签数据：首次通过/api/board一次取齐，之后按版本增量同步
+function fetchHomeworkAndLabels() {
+    const request = boardVersion
+        ? fetch('/api/homework/changes?since=' + encodeURIComponent(boardVersion), { cache: 'no-store' })
+            .then(response => response.json())
+        : fetchWithETag('/api/board');
+    request
+        .then(data => {
+            applyHomeworkChanges(data);
+            updateHomeworkContainer(groupHomeworkBySubject(), globalLabels, boardSubjectsOrder);
         })
         .catch(error => {
             console.error('获取作业数据失败:', error);
         });
 }
 
+// 将全量快照或增量变更合并到本地状态
+function applyHomeworkChanges(data) {
+    if (data.full) {
+        homeworkById.clear();
+        Object.values(data.submissions || {}).forEach(list => {
+            list.forEach(submission => homeworkById.set(submission.id, submission));
+        });
+    } else {
+        (data.added || []).forEach(submission => homeworkById.set(submission.id, submission));
+        (data.updated || []).forEach(submission => homeworkById.set(submission.id, submission));
+        (data.deleted || []).forEach(id => homeworkById.delete(id));
+    }
+    if (data.labels) {
+        globalLabels = data.labels;
+    }
+    if (data.subjects) {
+        boardSubjectsOrder = data.subjects;
+    }
+    boardVersion = data.version;
+}
+
+// 按学科分组本地作业（学科按首次出现的作业ID排序，与服务器一致）
+function groupHomeworkBySubject() {
+    const grouped = {};
+    Array.from(homeworkById.values())
+        .sort((a, b) => a.id - b.id)
+        .forEach(submission => {
+            if (!grouped[submission.subject]) {
+                grouped[submission.subject] = [];
+            }
+            grouped[submission.subject].push(submission);
+        });
+    return grouped;
+}
+
 // 计算最大列高度（优化版本）
 function calculateMaxColumnHeight() {
     const screenHeight = window.innerHeight;
@@ -763,8 +847,7 @@ function hideQuickPublishButton() {
 // 加载学科和标签数据
 function loadQuickPublishData() {
     // 加载学科数据
-    fetch('/api/subjects')
-        .then(response => response.json())
+    fetchWithETag('/api/subjects')
         .then(subjects => {
             subjectsData = subjects;
         })
@@ -773,8 +856,7 @@ function loadQuickPublishData() {
         });
     
     // 加载标签数据
-    fetch('/api/homework')
-        .then(response => response.json())
+    fetchWithETag('/api/homework')
         .then(data => {
             labelsData = data.labels || [];
         })
@@ -897,6 +979,11 @@ function initSubjectSelects() {
         select.addEventListener('blur', function() {
             this.style.backgroundColor = '';
         });
+        
+        // 切换学科时刷新常用词宫格
+        select.addEventListener('change', function() {
+            loadCommonWordsGrid(this.id === 'quickSubject2' ? 'commonWordsGrid2' : 'commonWordsGrid');
+        });
     });
 }
 
@@ -925,17 +1012,20 @@ function loadCommonWordsGrid(gridId) {
     // 备用常用词
     const defaultWords = ['练习', '复习', '预习', '作业', '试卷', '背诵', '默写', '作文', '笔记'];
     
-    // 尝试获取通用常用词
-    fetch('/api/global_words')
-        .then(response => {
-            if (response.ok) return response.json();
-            throw new Error('Network response was not ok');
-        })
-        .then(words => {
-            displayWords(words.length > 0 ? words : defaultWords, gridId);
+    // 从服务端获取当前学科最常用的9个词（通用词加学科常用词，按使用次数排序）
+    const subjectSelect = document.getElementById(gridId === 'commonWordsGrid2' ? 'quickSubject2' : 'quickSubject');
+    const params = new URLSearchParams({ limit: 9 });
+    if (subjectSelect && subjectSelect.value) {
+        params.set('subject', subjectSelect.value);
+    }
+    fetchWithETag('/api/words/suggest?' + params.toString())
+        .then(data => {
+            grid.innerHTML = '';
+            displayWords(data.words.length > 0 ? data.words : defaultWords, gridId);
         })
         .catch(() => {
             // 使用默认常用词
+            grid.innerHTML = '';
             displayWords(defaultWords, gridId);
         });
     
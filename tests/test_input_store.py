@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# app在导入时会在当前目录的data/下初始化数据文件，先切换到临时目录
+_workdir = tempfile.mkdtemp()
+os.makedirs(os.path.join(_workdir, 'data'))
+os.chdir(_workdir)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+class JsonlInputStoreCompactionTest(unittest.TestCase):
+    """压缩删掉最大id的墓碑后重启，新记录的id不能复用已删除的id"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'input.log')
+        self.index_path = self.path + '.idx'
+
+    def _compacted_store(self):
+        store = app.JsonlInputStore(self.path, self.index_path)
+        for i in range(6):
+            store.append({'name': f'学生{i}', 'message': 'hello'})
+        for entry_id in range(2, 7):
+            store.delete(entry_id)
+        self.assertEqual(store.compact(), 5)
+        return store
+
+    def test_restart_after_compaction_full_scan(self):
+        self._compacted_store()
+        restarted = app.JsonlInputStore(self.path, self.index_path)
+        self.assertEqual([entry['id'] for entry in restarted.all()], [1])
+        self.assertEqual(restarted.append({'name': '新', 'message': 'hi'})['id'], 7)
+
+    def test_restart_after_compaction_indexed(self):
+        self._compacted_store()
+        restarted = app.JsonlInputStore(self.path, self.index_path)
+        self.assertEqual(restarted.append({'name': '新', 'message': 'hi'})['id'], 7)
+        self.assertEqual([entry['id'] for entry in restarted.all()], [1, 7])
+
+    def test_restart_after_compaction_without_index(self):
+        # 索引与数据文件不匹配（如索引写入后文件又被压缩替换）时同样以索引中的next_id为下界
+        self._compacted_store()
+        restarted = app.JsonlInputStore(self.path, self.index_path)
+        restarted._load_index = lambda st: False
+        self.assertEqual(restarted.append({'name': '新', 'message': 'hi'})['id'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()